@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Main file: differential check and benchmark of the redaction backends
+Usage: ./3-main.py [messages] [seed]
+"""
+
+import random
+import sys
+import timeit
+
+get_redaction_engine = __import__('filtered_logger').get_redaction_engine
+TokenizingRedactionEngine = \
+    __import__('filtered_logger').TokenizingRedactionEngine
+
+MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+SEED = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+NAMES = ("name", "email", "phone", "ssn", "password", "ip", "last_login",
+         "user_agent", "a", "ame", "a=b")
+SEPARATORS = (";", ",", "|", " ")
+rng = random.Random(SEED)
+
+
+def random_text(separator: str) -> str:
+    """ A short value that may contain '=', never the separator
+    """
+    alphabet = "ab=x_" + rng.choice(NAMES)
+    return "".join(rng.choice(alphabet)
+                   for _ in range(rng.randint(0, 8))).replace(separator, "")
+
+
+def random_message(separator: str) -> str:
+    """ key=value records with prefixed and suffixed field names, empty
+    values, missing '=' and '=' inside values
+    """
+    parts = []
+    for _ in range(rng.randint(0, 8)):
+        key = rng.choice(NAMES)
+        if rng.random() < 0.3:
+            key = rng.choice(("x", "my_", "e", "")) + key
+        if rng.random() < 0.1:
+            key += rng.choice(("_", "s"))
+        if rng.random() < 0.1:
+            parts.append(key)
+        else:
+            parts.append("{}={}".format(key, random_text(separator)))
+    return separator.join(parts) + rng.choice(("", separator))
+
+
+mismatches = 0
+tokenized = 0
+for i in range(MESSAGES):
+    separator = rng.choice(SEPARATORS)
+    fields = tuple(rng.sample(NAMES, rng.randint(1, 5)))
+    message = random_message(separator)
+    regex = get_redaction_engine(fields, "***", separator, "regex")
+    tokenizer = get_redaction_engine(fields, "***", separator, "tokenizer")
+    # fields the scanner cannot mirror must fall back to the regex engine
+    assert (type(tokenizer) is TokenizingRedactionEngine) == \
+        TokenizingRedactionEngine.supports(fields, separator)
+    tokenized += type(tokenizer) is TokenizingRedactionEngine
+    expected = regex.redact(message)
+    result = tokenizer.redact(message)
+    if result != expected:
+        mismatches += 1
+        if mismatches <= 10:
+            print("MISMATCH {!r} {!r}\n  regex     {!r}\n  tokenizer {!r}"
+                  .format(fields, message, expected, result))
+print("{} messages ({} through the tokenizer), {} mismatches".format(
+    MESSAGES, tokenized, mismatches))
+
+fields = NAMES[:5]
+for n_fields in (10, 100, 1000, 10000):
+    message = ";".join("{}=value{}".format(NAMES[i % 10], i)
+                       for i in range(n_fields)) + ";"
+    timings = []
+    for backend in ("regex", "tokenizer"):
+        engine = get_redaction_engine(fields, "***", ";", backend)
+        number = max(1, 20000 // n_fields)
+        seconds = min(timeit.repeat(lambda: engine.redact(message),
+                                    number=number, repeat=5)) / number
+        timings.append("{} {:.1f} us".format(backend, seconds * 1e6))
+    print("{:>6} fields  {}".format(n_fields, "  ".join(timings)))
+
+sys.exit(1 if mismatches else 0)
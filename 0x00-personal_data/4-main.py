@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Main file: per-record work of get_logger after many calls
+Usage: ./4-main.py [calls]
+"""
+
+import io
+import sys
+
+filtered_logger = __import__('filtered_logger')
+get_logger = filtered_logger.get_logger
+RedactingFormatter = filtered_logger.RedactingFormatter
+
+CALLS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+calls = 0
+format_record = RedactingFormatter.format
+
+
+def counting_format(self, record):
+    """ RedactingFormatter.format, counted
+    """
+    global calls
+    calls += 1
+    return format_record(self, record)
+
+
+RedactingFormatter.format = counting_format
+failures = 0
+
+
+def check(label: str, logger):
+    """ Log one record and check it was formatted exactly once, by the
+    only handler installed and registered
+    """
+    global calls, failures
+    calls = 0
+    logger.info("name=Bob;email=bob@dylan.com;ip=127.0.0.1;")
+    for handler in logger.handlers:
+        handler.flush()
+    ok = calls == 1 and len(logger.handlers) == 1 and \
+        len(filtered_logger._HANDLERS) == 1
+    failures += not ok
+    print("{:<44} format calls {}, handlers {}, registered {}  {}".format(
+        label, calls, len(logger.handlers),
+        len(filtered_logger._HANDLERS), "OK" if ok else "FAIL"))
+
+
+stream = io.StringIO()
+for _ in range(CALLS):
+    logger = get_logger(stream=stream)
+check("{} x get_logger(stream)".format(CALLS), logger)
+
+for i in range(CALLS):
+    logger = get_logger(fields=("name", "email")[:i % 2 + 1], stream=stream)
+check("{} x alternating fields".format(CALLS), logger)
+
+for _ in range(CALLS):
+    logger = get_logger(stream=io.StringIO())
+check("{} x get_logger(stream=<new stream>)".format(CALLS), logger)
+
+for i in range(CALLS):
+    logger = get_logger(asynchronous=bool(i % 2), stream=stream)
+check("{} x alternating asynchronous".format(CALLS), logger)
+
+logger.handlers[0].close()
+logger = get_logger(asynchronous=True, stream=stream)
+check("get_logger after handler.close()", logger)
+
+sys.exit(1 if failures else 0)
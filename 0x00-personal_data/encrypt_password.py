@@ -3,16 +3,27 @@
 Module for hashing passwords with bcrypt.
 """
 
+import os
+import time
+import asyncio
 import bcrypt
+from concurrent.futures import (Executor, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from typing import Iterable, List, Optional, Tuple
 
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
 
-def hash_password(password: str) -> bytes:
+
+def hash_password(password: str, rounds: int = None) -> bytes:
     """
     Implement a hash_password
-    Args: one string argument name password
+    Args: one string argument name password, and optionally the bcrypt
+    cost (BCRYPT_ROUNDS by default)
     Returns a salted, hashed password, which is a byte string
     """
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password.encode(), salt)
     return hashed
 
@@ -24,3 +35,140 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
     Use bcrypt to validate that the provided password
     """
     return bcrypt.checkpw(password.encode(), hashed_password)
+
+
+def get_rounds(hashed_password: bytes) -> int:
+    """
+    Read the cost a hash was made with, from its "$2b$<rounds>$" prefix
+    """
+    return int(hashed_password.split(b'$')[2])
+
+
+def needs_rehash(hashed_password: bytes, rounds: int = None) -> bool:
+    """
+    Tell whether a hash uses a lower cost than the current one
+    (BCRYPT_ROUNDS by default)
+    """
+    return get_rounds(hashed_password) < (rounds or BCRYPT_ROUNDS)
+
+
+def verify_and_update(hashed_password: bytes, password: str,
+                      rounds: int = None) -> Tuple[bool, Optional[bytes]]:
+    """
+    Validate a password like is_valid, and rehash it if the stored hash
+    uses an outdated cost
+    Returns (valid, new_hash), new_hash being None unless the password
+    is valid and should be stored again
+    """
+    if not is_valid(hashed_password, password):
+        return False, None
+    if needs_rehash(hashed_password, rounds):
+        return True, hash_password(password, rounds)
+    return True, None
+
+
+def calibrate_rounds(budget_ms: float = 50, password: str = "calibration",
+                     minimum: int = MIN_ROUNDS) -> int:
+    """
+    Pick the highest bcrypt cost whose hash time fits a latency budget
+    on this machine. Each extra round doubles the time, so the search
+    costs about twice the budget.
+    Args:
+        budget_ms: target time for a single hash, in milliseconds
+        password: password hashed during the measurement
+        minimum: cost returned even if it exceeds the budget
+    Returns the number of rounds to use
+    """
+    rounds = max(minimum, MIN_ROUNDS)
+    while rounds < MAX_ROUNDS:
+        start = time.perf_counter()
+        bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds + 1))
+        if (time.perf_counter() - start) * 1000 > budget_ms:
+            break
+        rounds += 1
+    return rounds
+
+
+def _is_valid_pair(pair: Tuple[bytes, str]) -> bool:
+    """
+    Unpack a (hashed_password, password) pair for is_valid,
+    module-level so the process pool can pickle it
+    """
+    return is_valid(*pair)
+
+
+class HashingService:
+    """
+    Runs hash_password and is_valid on a pool of workers.
+    bcrypt releases the GIL, so the thread backend already spreads
+    over all cores; the process backend avoids the GIL altogether.
+    """
+
+    BACKENDS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
+    def __init__(self, backend: str = "thread", max_workers: int = None):
+        """
+        Initialize the worker pool
+        Args:
+            backend: "thread" or "process"
+            max_workers: number of workers, one per core by default
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError("Unknown hashing backend: {}".format(backend))
+        self.backend = backend
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor: Executor = self.BACKENDS[backend](self.max_workers)
+
+    def hash_password(self, password: str) -> bytes:
+        """ Hash one password on a worker
+        """
+        return self.executor.submit(hash_password, password).result()
+
+    def is_valid(self, hashed_password: bytes, password: str) -> bool:
+        """ Check one password on a worker
+        """
+        return self.executor.submit(is_valid, hashed_password,
+                                    password).result()
+
+    def hash_many(self, passwords: Iterable[str]) -> List[bytes]:
+        """
+        Hash passwords in parallel
+        Returns the hashes in the order of the passwords
+        """
+        return list(self.executor.map(hash_password, passwords))
+
+    def verify_many(self, pairs: Iterable[Tuple[bytes, str]]) -> List[bool]:
+        """
+        Check (hashed_password, password) pairs in parallel
+        Returns the results in the order of the pairs
+        """
+        return list(self.executor.map(_is_valid_pair, pairs))
+
+    async def ahash_password(self, password: str) -> bytes:
+        """ Hash one password without blocking the event loop
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, hash_password,
+                                          password)
+
+    async def ais_valid(self, hashed_password: bytes, password: str) -> bool:
+        """ Check one password without blocking the event loop
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, is_valid,
+                                          hashed_password, password)
+
+    def shutdown(self, wait: bool = True):
+        """ Stop the workers
+        """
+        self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        """ Use the service as a context manager
+        """
+        return self
+
+    def __exit__(self, *exc):
+        """ Stop the workers when leaving the block
+        """
+        self.shutdown()
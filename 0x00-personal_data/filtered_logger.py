@@ -5,15 +5,195 @@ REGEX-ING of logs
 
 import os
 import re
+import sys
+import time
+import queue
 import logging
-from typing import List
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, List, Match, Optional, TextIO, Tuple
 import mysql.connector
 from mysql.connector import Error
 
 PII_FIELDS = ("name", "email", "phone", "ssn", "password")
+ENGINE_CACHE_SIZE = 64
+DECISION_CACHE_SIZE = 4096
+QUEUE_SIZE = 10000
+BATCH_SIZE = 256
+EXPORT_BATCH_SIZE = 1000
+POOL_SIZE = 5
+POOL_IDLE_TIMEOUT = 300.0
+_STOP = object()
+_FORMATTERS = {}
+_HANDLERS = {}
+_REGISTRY_LOCK = threading.Lock()
+_POOL = None
 
 
-def filter_datum(fields: List[str], redaction: str, message: str, separator: str) -> str:
+class RedactionEngine:
+    """ Compiled redaction for one (fields, separator, redaction) setup
+    """
+
+    def __init__(self, fields: Tuple[str, ...], redaction: str,
+                 separator: str):
+        """
+        Compile the pattern and the per-field replacements once.
+        Args:
+            fields: The fields to obfuscate
+            redaction: The string to replace the field values with.
+            separator: The character that separates fields in the logs
+        """
+        self.fields = fields
+        self.redaction = redaction
+        self.separator = separator
+        self.pattern = re.compile('|'.join(
+            "{}=[^{}]+".format(field, separator) for field in fields))
+        self.replacements = {field: "{}={}".format(field, redaction)
+                             for field in fields}
+
+    def _replace(self, match: Match) -> str:
+        """ Return the precomputed replacement for a matched field
+        """
+        key = match[0].partition('=')[0]
+        replacement = self.replacements.get(key)
+        if replacement is None:
+            # the field is a pattern: keep the key as written in the message
+            replacement = "{}={}".format(key, self.redaction)
+        return replacement
+
+    def redact(self, message: str) -> str:
+        """
+        Obfuscate the configured fields in a single message.
+        Args:
+            message: The log message
+
+        Return:
+            The log message obfuscated
+        """
+        return self.pattern.sub(self._replace, message)
+
+
+class TokenizingRedactionEngine(RedactionEngine):
+    """ Single-pass redaction for literal fields, without a regex
+    """
+
+    def __init__(self, fields: Tuple[str, ...], redaction: str,
+                 separator: str):
+        """
+        Build the lookup tables used by the scanner.
+        Args:
+            fields: The fields to obfuscate
+            redaction: The string to replace the field values with.
+            separator: The character that separates fields in the logs
+        """
+        super().__init__(fields, redaction, separator)
+        self.field_set = frozenset(fields)
+        self.lengths = sorted({len(field) for field in fields}, reverse=True)
+        self.suffix = "={}".format(redaction)
+        self.decisions = {}
+
+    @staticmethod
+    def supports(fields: Tuple[str, ...], separator: str) -> bool:
+        """
+        Tell whether the scanner reproduces the regex output exactly,
+        i.e. fields are plain names without '=' and the separator a
+        single character.
+        """
+        if len(separator) != 1 or separator in "\\]^=":
+            return False
+        for field in fields:
+            if not field or re.escape(field) != field or \
+                    separator in field or '=' in field:
+                return False
+        return True
+
+    def _is_redacted(self, key: str) -> bool:
+        """ Check whether a field name ends the given key, like the regex
+        """
+        redacted = self.decisions.get(key)
+        if redacted is None:
+            size = len(key)
+            redacted = key in self.field_set or any(
+                length < size and key[size - length:] in self.field_set
+                for length in self.lengths)
+            if len(self.decisions) >= DECISION_CACHE_SIZE:
+                self.decisions.clear()
+            self.decisions[key] = redacted
+        return redacted
+
+    def _redact_value(self, part: str, start: int) -> str:
+        """ Look for a field after another '=' inside a single token
+        """
+        end = len(part) - 1
+        while True:
+            equal = part.find('=', start)
+            if equal == -1 or equal == end:
+                return part
+            if self._is_redacted(part[start:equal]):
+                return part[:equal] + self.suffix
+            start = equal + 1
+
+    def redact(self, message: str) -> str:
+        """
+        Obfuscate the configured fields in a single message.
+        Args:
+            message: The log message
+
+        Return:
+            The log message obfuscated
+        """
+        parts = message.split(self.separator)
+        decisions = self.decisions
+        suffix = self.suffix
+        for i, part in enumerate(parts):
+            key, _, value = part.partition('=')
+            if not value:
+                continue
+            redacted = decisions.get(key)
+            if redacted is None:
+                redacted = self._is_redacted(key)
+            if redacted:
+                parts[i] = key + suffix
+            elif '=' in value:
+                parts[i] = self._redact_value(part, len(key) + 1)
+        return self.separator.join(parts)
+
+
+REDACTION_BACKENDS = {
+    "regex": RedactionEngine,
+    "tokenizer": TokenizingRedactionEngine,
+}
+
+
+@lru_cache(maxsize=ENGINE_CACHE_SIZE)
+def get_redaction_engine(fields: Tuple[str, ...], redaction: str,
+                         separator: str,
+                         backend: str = "regex") -> RedactionEngine:
+    """
+    Return the cached engine for a configuration, building it if needed.
+    The tokenizer backend falls back to the regex one for fields it
+    cannot handle identically.
+    Args:
+        fields: The fields to obfuscate, as a hashable tuple
+        redaction: The string to replace the field values with.
+        separator: The character that separates fields in the logs
+        backend: A key of REDACTION_BACKENDS
+
+    Return:
+        RedactionEngine object
+    """
+    if backend not in REDACTION_BACKENDS:
+        raise ValueError("Unknown redaction backend: {}".format(backend))
+    engine_class = REDACTION_BACKENDS[backend]
+    if engine_class is TokenizingRedactionEngine and \
+            not TokenizingRedactionEngine.supports(fields, separator):
+        engine_class = RedactionEngine
+    return engine_class(fields, redaction, separator)
+
+
+def filter_datum(fields: List[str], redaction: str, message: str,
+                 separator: str, backend: str = "regex") -> str:
     """
     Use a regex to replace occurrences of certain field values.
     Args:
@@ -21,12 +201,14 @@ def filter_datum(fields: List[str], redaction: str, message: str, separator: str
         redaction: The string to replace the field values with.
         message: The log message
         separator: The character that separates fields in the logs
+        backend: "regex" (default) or "tokenizer"
 
     Return:
         The log message obfuscated
     """
-    p = '|'.join(f"{field}=[^{separator}]+" for field in fields)
-    return re.sub(p, lambda m: f"{m.group().split('=')[0]}={redaction}", message)
+    engine = get_redaction_engine(tuple(fields), redaction, separator,
+                                  backend)
+    return engine.redact(message)
 
 
 class RedactingFormatter(logging.Formatter):
@@ -37,14 +219,16 @@ class RedactingFormatter(logging.Formatter):
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], backend: str = "regex"):
         """
         Initialize the formatter
         Args:
             fields: field to redact
+            backend: redaction backend, "regex" or "tokenizer"
         """
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.backend = backend
 
     def format(self, record: logging.LogRecord) -> str:
         """
@@ -57,12 +241,209 @@ class RedactingFormatter(logging.Formatter):
             str: The formatted and obfuscated log record
         """
         initial_mess = super().format(record)
-        return filter_datum(self.fields, self.REDACTION, initial_mess, self.SEPARATOR)
+        return filter_datum(self.fields, self.REDACTION, initial_mess,
+                            self.SEPARATOR, self.backend)
 
 
-def get_logger() -> logging.Logger:
+class AsyncRedactingHandler(logging.Handler):
+    """ Handler that redacts and writes records from a background thread
+    """
+
+    DROP_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+    def __init__(self, stream: TextIO = None, queue_size: int = QUEUE_SIZE,
+                 batch_size: int = BATCH_SIZE, drop_policy: str = "block",
+                 block_timeout: Optional[float] = None):
+        """
+        Initialize the handler and start its worker thread
+        Args:
+            stream: where formatted records are written, sys.stderr if None
+            queue_size: maximum number of records waiting to be written
+            batch_size: maximum number of records written at once
+            drop_policy: what to do when the queue is full:
+                "block" waits for room (up to block_timeout seconds),
+                "drop_newest" discards the incoming record,
+                "drop_oldest" discards the oldest queued record
+            block_timeout: seconds "block" waits before dropping the
+                record, None to wait forever
+        """
+        if drop_policy not in self.DROP_POLICIES:
+            raise ValueError("Unknown drop policy: {}".format(drop_policy))
+        super().__init__()
+        self.stream = stream if stream is not None else sys.stderr
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self.written = 0
+        self._closed = False
+        self._dropped_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run,
+                                        name="user_data-logger",
+                                        daemon=True)
+        self._worker.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """ Number of records waiting to be written
+        """
+        return self.queue.qsize()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Render the message in the caller's thread, so the worker never
+        sees arguments that were mutated after the call.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def _drop(self, count: int = 1):
+        """ Count discarded records, emit runs in many threads
+        """
+        with self._dropped_lock:
+            self.dropped += count
+
+    def emit(self, record: logging.LogRecord):
+        """
+        Queue a record, applying the drop policy if the queue is full.
+        Records emitted after close() are dropped, nothing would write them.
+        Args:
+            record: The log record to queue.
+        """
+        if self._closed:
+            self._drop()
+            return
+        record = self.prepare(record)
+        try:
+            if self.drop_policy == "block":
+                self.queue.put(record, timeout=self.block_timeout)
+            elif self.drop_policy == "drop_newest":
+                self.queue.put_nowait(record)
+            else:
+                self._put_dropping_oldest(record)
+        except queue.Full:
+            self._drop()
+
+    def _put_dropping_oldest(self, record: logging.LogRecord):
+        """ Make room by discarding queued records until the record fits
+        """
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                pass
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                continue
+            self.queue.task_done()
+            self._drop()
+
+    def _run(self):
+        """ Worker loop: format and write records batch by batch
+        """
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [r for r in batch if r is not _STOP]
+            stopping = len(records) != len(batch)
+            self._write(records)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write(self, records: List[logging.LogRecord]):
+        """ Format a batch of records and write them with a single call
+        """
+        if not records:
+            return
+        try:
+            lines = [self.format(record) for record in records]
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+            self.written += len(records)
+        except Exception:
+            self.handleError(records[-1])
+
+    def flush(self):
+        """ Block until every queued record has been written
+        """
+        if self._worker.is_alive():
+            self.queue.join()
+
+    def close(self):
+        """ Write the remaining records, stop the worker thread and
+        unregister the handler so get_logger never returns it again
+        """
+        self._closed = True
+        if self._worker.is_alive():
+            self.queue.put(_STOP)
+            self._worker.join()
+        # records queued by an emit racing with close are never written
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.queue.task_done()
+            self._drop()
+        _unregister_handler(self)
+        super().close()
+
+
+def _get_formatter(fields: Tuple[str, ...],
+                   backend: str) -> RedactingFormatter:
+    """ Return the registered formatter for a configuration
+    """
+    key = (fields, backend)
+    if key not in _FORMATTERS:
+        _FORMATTERS[key] = RedactingFormatter(fields=fields, backend=backend)
+    return _FORMATTERS[key]
+
+
+def _unregister_handler(handler: logging.Handler):
+    """ Forget a handler, so that its configuration gets a new one
+    """
+    with _REGISTRY_LOCK:
+        for key, registered in list(_HANDLERS.items()):
+            if registered is handler:
+                del _HANDLERS[key]
+
+
+def _get_handler(asynchronous: bool, options: dict) -> logging.Handler:
+    """ Return the registered handler for a configuration
+    """
+    key = (asynchronous, tuple(sorted(options.items())))
+    if key not in _HANDLERS:
+        if asynchronous:
+            _HANDLERS[key] = AsyncRedactingHandler(**options)
+        else:
+            _HANDLERS[key] = logging.StreamHandler(**options)
+    return _HANDLERS[key]
+
+
+def get_logger(fields: List[str] = PII_FIELDS, backend: str = "regex",
+               asynchronous: bool = False, **options) -> logging.Logger:
     """
     Creates and returns a logger with a specific configuration.
+    Calling it again never stacks handlers: the same configuration
+    returns the logger untouched, a different one swaps the handler
+    and formatter it previously installed, so it is also the way to
+    change fields or destination at runtime. A swapped out handler is
+    closed and forgotten.
+    Args:
+        fields: fields to redact
+        backend: redaction backend, "regex" or "tokenizer"
+        asynchronous: write through an AsyncRedactingHandler instead of
+            a StreamHandler, so callers never wait for the stream
+        options: keyword arguments of the handler (e.g. stream)
     Return:
         logging.Logger object
     """
@@ -70,11 +451,30 @@ def get_logger() -> logging.Logger:
     logger.setLevel(logging.INFO)
     logger.propagate = False
 
-    stream_handler = logging.StreamHandler()
-    formatter = RedactingFormatter(fields=PII_FIELDS)
-    stream_handler.setFormatter(formatter)
+    swapped = []
+    with _REGISTRY_LOCK:
+        stream_handler = _get_handler(asynchronous, options)
+        formatter = _get_formatter(tuple(fields), backend)
+        stream_handler.setFormatter(formatter)
 
-    logger.addHandler(stream_handler)
+        registered = list(_HANDLERS.values())
+        for handler in list(logger.handlers):
+            closed = isinstance(handler, AsyncRedactingHandler) and \
+                handler._closed
+            if handler is not stream_handler and \
+                    (handler in registered or closed):
+                logger.removeHandler(handler)
+                swapped.append(handler)
+        for key, handler in list(_HANDLERS.items()):
+            if handler in swapped:
+                del _HANDLERS[key]
+        if stream_handler not in logger.handlers:
+            logger.addHandler(stream_handler)
+
+    # closing writes the queued records, do it without the lock
+    for handler in swapped:
+        handler.flush()
+        handler.close()
 
     return logger
 
@@ -105,3 +505,219 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     except Error as e:
         print(f"Error connecting to MySQL database: {e}")
         raise
+
+
+class ConnectionPool:
+    """ Pool of reusable database connections
+    """
+
+    def __init__(self, connect: Callable = None, size: int = POOL_SIZE,
+                 idle_timeout: float = POOL_IDLE_TIMEOUT,
+                 health_check: Callable = None, reset: Callable = None):
+        """
+        Initialize an empty pool, connections are opened on demand
+        Args:
+            connect: function opening a new connection, get_db by default
+            size: maximum number of open connections
+            idle_timeout: seconds after which an idle connection is closed
+            health_check: function telling whether a connection is usable,
+                is_connected() by default
+            reset: function ending the work of a borrower on release,
+                rollback() by default: autocommit is off, so even a
+                SELECT leaves a transaction (and its snapshot) open, and
+                rollback also consumes unread results
+        """
+        self.connect = connect if connect is not None else get_db
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check if health_check is not None \
+            else (lambda connection: connection.is_connected())
+        self.reset = reset if reset is not None \
+            else (lambda connection: connection.rollback())
+        self._idle = []
+        # id -> connection, for the connections lent by acquire
+        self._checked_out = {}
+        self._open = 0
+        self._condition = threading.Condition()
+
+    def _evict_idle(self):
+        """ Close connections that stayed idle longer than idle_timeout
+        """
+        deadline = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][1] < deadline:
+            connection, _ = self._idle.pop(0)
+            self._discard(connection)
+
+    def _discard(self, connection):
+        """ Close a connection and free its slot
+        """
+        self._checked_out.pop(id(connection), None)
+        self._open -= 1
+        self._condition.notify()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout: Optional[float] = None):
+        """
+        Check out a healthy connection, opening one if a slot is free.
+        The health check (a server round trip by default) runs without
+        the lock, so other threads keep checking out meanwhile.
+        Args:
+            timeout: seconds to wait for a free slot, None to wait forever
+        Return:
+            a database connection
+        """
+        while True:
+            with self._condition:
+                while True:
+                    self._evict_idle()
+                    if self._idle:
+                        connection, _ = self._idle.pop()
+                        self._checked_out[id(connection)] = connection
+                        break
+                    if self._open < self.size:
+                        self._open += 1
+                        connection = None
+                        break
+                    if not self._condition.wait(timeout):
+                        raise TimeoutError(
+                            "No database connection available")
+            if connection is None:
+                break
+            if self._is_healthy(connection):
+                return connection
+            with self._condition:
+                self._discard(connection)
+        try:
+            connection = self.connect()
+        except Exception:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._checked_out[id(connection)] = connection
+        return connection
+
+    def _is_healthy(self, connection) -> bool:
+        """ Run the health check, treating errors as a dead connection
+        """
+        try:
+            return bool(self.health_check(connection))
+        except Exception:
+            return False
+
+    def release(self, connection):
+        """
+        Reset a connection and return it to the pool, or close it if the
+        reset failed. The reset runs without the lock.
+        Args:
+            connection: a connection obtained from acquire
+        Raise:
+            ValueError: the connection is not checked out from this pool,
+                e.g. it was already released
+        """
+        with self._condition:
+            if self._checked_out.pop(id(connection), None) is None:
+                raise ValueError(
+                    "Connection not checked out from this pool")
+        try:
+            self.reset(connection)
+        except Exception:
+            with self._condition:
+                self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """
+        Context manager lending a connection, returned to the pool on
+        exit or closed if the block raised
+        """
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        except BaseException:
+            with self._condition:
+                self._discard(connection)
+            raise
+        self.release(connection)
+
+    def close(self):
+        """ Close every idle connection
+        """
+        with self._condition:
+            while self._idle:
+                connection, _ = self._idle.pop()
+                self._discard(connection)
+
+
+def get_db_pool() -> ConnectionPool:
+    """
+    Return the process-wide connection pool, configured by
+    PERSONAL_DATA_DB_POOL_SIZE and PERSONAL_DATA_DB_POOL_IDLE_TIMEOUT
+    on top of the get_db variables.
+    Return:
+        ConnectionPool object
+    """
+    global _POOL
+    with _REGISTRY_LOCK:
+        if _POOL is None:
+            size = int(os.getenv('PERSONAL_DATA_DB_POOL_SIZE', POOL_SIZE))
+            idle_timeout = float(os.getenv(
+                'PERSONAL_DATA_DB_POOL_IDLE_TIMEOUT', POOL_IDLE_TIMEOUT))
+            _POOL = ConnectionPool(get_db, size, idle_timeout)
+        return _POOL
+
+
+def export_users(db, logger: logging.Logger,
+                 batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """
+    Stream every row of the users table through the redacting logger.
+    Rows are fetched batch by batch from an unbuffered cursor, so memory
+    does not depend on the size of the table.
+    Args:
+        db: an open DB-API connection (MySQL, or sqlite3 for tests)
+        logger: the logger records are written to
+        batch_size: number of rows fetched at once
+    Return:
+        the number of rows exported
+    """
+    cursor = db.cursor()
+    count = 0
+    try:
+        cursor.execute("SELECT * FROM users;")
+        columns = [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                logger.info("".join("{}={}; ".format(column, value)
+                                    for column, value in zip(columns, row)))
+            count += len(rows)
+    finally:
+        cursor.close()
+    return count
+
+
+def main():
+    """
+    Obtain a database connection using get_db and display each row of
+    the users table under a filtered format.
+    """
+    db = get_db()
+    logger = get_logger()
+    try:
+        export_users(db, logger)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,10 @@ from os import getenv
 from api.v1.views import app_views
 from flask import Flask, jsonify, abort, request
 from flask_cors import CORS
-from api.v1.auth.auth import Auth
+from api.v1.auth.auth import Auth, ExclusionMatcher
 from api.v1.auth.basic_auth import BasicAuth
+from models.base import LOOKUPS
+import threading
 
 app = Flask(__name__)
 app.register_blueprint(app_views)
@@ -21,35 +23,67 @@ if auth_type == 'basic_auth':
 else:
     auth = Auth()
 
+excluded_paths = ExclusionMatcher(['/api/v1/status/', '/api/v1/unauthorized/',
+                                   '/api/v1/forbidden/'])
+
+# API_REQUEST_COUNTERS=1: X-Auth-Resolutions and X-Store-Lookups headers
+# on each response, and totals per endpoint in request_counters
+counters_enabled = getenv('API_REQUEST_COUNTERS', '0') == '1'
+request_counters = {}
+request_counters_lock = threading.Lock()
+
+
 @app.errorhandler(404)
 def not_found(error) -> str:
     """ Not found handler """
     return jsonify({"error": "Not found"}), 404
 
+
 @app.errorhandler(401)
 def unauthorized(error) -> str:
     """ Unauthorized handler """
     return jsonify({"error": "Unauthorized"}), 401
 
+
 @app.errorhandler(403)
 def forbidden(error) -> str:
     """ Forbidden handler """
     return jsonify({"error": "Forbidden"}), 403
 
+
 @app.before_request
 def before_request():
     """ Filter each request before processing """
-    if auth is None:
-        return
-    excluded_paths = ['/api/v1/status/', '/api/v1/unauthorized/', '/api/v1/forbidden/']
-    if not auth.require_auth(request.path, excluded_paths):
+    LOOKUPS.count = 0
+    if auth is None or not auth.require_auth(request.path, excluded_paths):
+        request.current_user = None
         return
     if auth.authorization_header(request) is None:
         abort(401)
-    if auth.current_user(request) is None:
+    if auth.resolve_user(request) is None:
         abort(403)
 
+
+@app.after_request
+def after_request(response):
+    """ Report the auth resolutions and store lookups of the request """
+    if not counters_enabled:
+        return response
+    resolutions = getattr(request, 'auth_resolutions', 0)
+    lookups = getattr(LOOKUPS, 'count', 0)
+    with request_counters_lock:
+        totals = request_counters.setdefault(
+            request.endpoint,
+            {'requests': 0, 'auth_resolutions': 0, 'store_lookups': 0})
+        totals['requests'] += 1
+        totals['auth_resolutions'] += resolutions
+        totals['store_lookups'] += lookups
+    response.headers['X-Auth-Resolutions'] = str(resolutions)
+    response.headers['X-Store-Lookups'] = str(lookups)
+    return response
+
+
 if __name__ == "__main__":
     host = getenv("API_HOST", "0.0.0.0")
     port = getenv("API_PORT", "5000")
-    app.run(host=host, port=port)i
+    app.run(host=host, port=port)
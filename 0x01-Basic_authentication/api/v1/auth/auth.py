@@ -4,7 +4,81 @@ An Auth class
 """
 
 from flask import request
+from functools import lru_cache
 from typing import List, TypeVar
+import fnmatch
+import re
+
+EXACT, PREFIX = 0, 1
+WILDCARDS = re.compile(r'[*?[]')
+
+
+class ExclusionMatcher:
+    """Matches request paths against excluded paths, compiled once:
+    plain paths and paths ending with a single '*' go in a prefix trie,
+    other fnmatch patterns in one regex"""
+
+    CACHE_SIZE = 4096
+
+    def __init__(self, excluded_paths: List[str]):
+        """Builds the trie and the regex of the excluded paths"""
+        self.excluded_paths = list(excluded_paths or [])
+        self._trie = {}
+        self._cache = {}
+        patterns = []
+        for excl_path in self.excluded_paths:
+            if excl_path.endswith('*') and \
+                    not WILDCARDS.search(excl_path[:-1]):
+                self._insert(excl_path[:-1], PREFIX)
+                continue
+            # Normalize excluded path to have a trailing slash if it
+            # doesn't have *
+            if not excl_path.endswith('*'):
+                excl_path = excl_path.rstrip('/') + '/'
+            if WILDCARDS.search(excl_path):
+                patterns.append(fnmatch.translate(excl_path))
+            else:
+                self._insert(excl_path, EXACT)
+        self._regex = re.compile('|'.join(patterns)) if patterns else None
+
+    def _insert(self, key: str, kind: int):
+        """Adds an exact or prefix entry to the trie"""
+        node = self._trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node[kind] = True
+
+    def _trie_match(self, path: str) -> bool:
+        """Checks if an entry of the trie is a prefix of (or equals) the
+        path"""
+        node = self._trie
+        for char in path:
+            if PREFIX in node:
+                return True
+            node = node.get(char)
+            if node is None:
+                return False
+        return PREFIX in node or EXACT in node
+
+    def excluded(self, path: str) -> bool:
+        """Checks if a path is excluded, with a per-path cache"""
+        # Normalize the path to always have a trailing slash
+        path = path.rstrip('/') + '/'
+        result = self._cache.get(path)
+        if result is None:
+            result = self._trie_match(path) or (
+                self._regex is not None and
+                self._regex.match(path) is not None)
+            if len(self._cache) >= self.CACHE_SIZE:
+                self._cache.clear()
+            self._cache[path] = result
+        return result
+
+
+@lru_cache(maxsize=32)
+def exclusion_matcher(excluded_paths: tuple) -> ExclusionMatcher:
+    """Returns the matcher of a list of excluded paths, built once"""
+    return ExclusionMatcher(excluded_paths)
 
 
 class Auth:
@@ -14,19 +88,12 @@ class Auth:
         """Checks if a path requires authentication"""
         if path is None:
             return True
+        if isinstance(excluded_paths, ExclusionMatcher):
+            return not excluded_paths.excluded(path)
         if not excluded_paths or not isinstance(excluded_paths, list):
             return True
 
-        # Normalize the path to always have a trailing slash
-        path = path.rstrip('/') + '/'
-
-        for excl_path in excluded_paths:
-            # Normalize excluded path to have a trailing slash if it doesn't have *
-            excl_path = excl_path.rstrip('/') + '/' if not excl_path.endswith('*') else excl_path
-            if fnmatch.fnmatch(path, excl_path):
-                return False
-
-        return True
+        return not exclusion_matcher(tuple(excluded_paths)).excluded(path)
 
 
     def authorization_header(self, request=None) -> str:
@@ -38,3 +105,16 @@ class Auth:
     def current_user(self, request=None) -> TypeVar('User'):
         """ Get the current user from the request """
         return None
+
+    def resolve_user(self, request=None) -> TypeVar('User'):
+        """ Get the current user of the request, resolved at most once
+        per request and kept on request.current_user """
+        if request is None:
+            return None
+        try:
+            return request.current_user
+        except AttributeError:
+            pass
+        request.auth_resolutions = getattr(request, 'auth_resolutions', 0) + 1
+        request.current_user = self.current_user(request)
+        return request.current_user
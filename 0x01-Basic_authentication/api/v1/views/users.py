@@ -2,7 +2,8 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, jsonify, request
+from models import codec
 from models.user import User
 
 
@@ -13,20 +14,26 @@ def view_all_users() -> str:
       - list of all User objects JSON represented
     """
     all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    # same body as jsonify, serialized with the fastest codec installed
+    return Response(codec.dumps(all_users, sort_keys=True) + "\n",
+                    mimetype="application/json")
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
 def view_one_user(user_id: str = None) -> str:
     """ GET /api/v1/users/:id
     Path parameter:
-      - User ID
+      - User ID, or "me" for the authenticated User
     Return:
       - User object JSON represented
       - 404 if the User ID doesn't exist
     """
     if user_id is None:
         abort(404)
+    if user_id == "me":
+        if request.current_user is None:
+            abort(404)
+        return jsonify(request.current_user.to_json())
     user = User.get(user_id)
     if user is None:
         abort(404)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+""" Binary snapshot module
+
+Layout (little endian):
+    header   b"MDBS", u16 version, u32 fields, u32 keys, u32 records,
+             u64 offset of the index
+    fields   string table of the field names (u16 length, UTF-8); the
+             first `keys` ones (id and INDEXED_ATTRIBUTES) are repeated
+             in the index
+    records  u32 length, then one value per field
+    index    u64 offset of each record, then per key: u32 length and the
+             JSON array of the values of the records (null if absent)
+    value    u8 tag (ABSENT, NONE, STR or JSON), then for STR and JSON
+             u32 length and UTF-8 bytes
+"""
+from typing import Iterable, List
+import array
+import importlib
+import mmap
+import struct
+import sys
+
+from models import codec
+
+
+MAGIC = b"MDBS"
+VERSION = 1
+HEADER = struct.Struct("<4sHIIIQ")
+U16 = struct.Struct("<H")
+U32 = struct.Struct("<I")
+U64 = struct.Struct("<Q")
+ABSENT, NONE, STR, JSON = range(4)
+MISSING = object()
+
+
+def _pack_value(parts: list, record: dict, field: str):
+    """ Append the encoding of record[field] to parts
+    """
+    if field not in record:
+        parts.append(bytes((ABSENT,)))
+        return
+    value = record[field]
+    if value is None:
+        parts.append(bytes((NONE,)))
+        return
+    if type(value) is str:
+        tag, data = STR, value.encode()
+    else:
+        tag, data = JSON, codec.dumps(value).encode()
+    parts.append(bytes((tag,)) + U32.pack(len(data)))
+    parts.append(data)
+
+
+def _unpack_value(buf, offset: int) -> tuple:
+    """ (value, offset after it) of the value encoded at offset,
+    value being MISSING for an absent field
+    """
+    tag = buf[offset]
+    if tag == ABSENT:
+        return MISSING, offset + 1
+    if tag == NONE:
+        return None, offset + 1
+    length, = U32.unpack_from(buf, offset + 1)
+    start = offset + 5
+    data = str(buf[start:start + length], 'utf-8')
+    if tag == JSON:
+        data = codec.loads(data)
+    return data, start + length
+
+
+def dumps(records: List[dict], keys: Iterable[str]) -> bytes:
+    """ Binary snapshot of records (JSON dictionaries), indexed on keys
+    """
+    keys = list(keys)
+    fields = list(keys)
+    seen = set(fields)
+    for record in records:
+        for field in record:
+            if field not in seen:
+                seen.add(field)
+                fields.append(field)
+
+    table = []
+    for field in fields:
+        name = field.encode()
+        table.append(U16.pack(len(name)) + name)
+    table = b"".join(table)
+
+    body = []
+    offsets = []
+    position = HEADER.size + len(table)
+    for record in records:
+        parts = []
+        for field in fields:
+            _pack_value(parts, record, field)
+        data = b"".join(parts)
+        offsets.append(position)
+        body.append(U32.pack(len(data)))
+        body.append(data)
+        position += U32.size + len(data)
+
+    index = [array.array('Q', offsets).tobytes()]
+    for key in keys:
+        column = codec.dumps([record.get(key) for record in records])
+        column = column.encode()
+        index.append(U32.pack(len(column)))
+        index.append(column)
+
+    header = HEADER.pack(MAGIC, VERSION, len(fields), len(keys),
+                         len(records), position)
+    return b"".join([header, table] + body + index)
+
+
+class SnapshotRecord():
+    """ Record of a binary snapshot, decoded on demand
+    """
+
+    __slots__ = ('snapshot', 'offset', 'keys')
+
+    def __init__(self, snapshot: 'BinarySnapshot', offset: int,
+                 keys: tuple):
+        """ Initialize a record from its offset and key values
+        """
+        self.snapshot = snapshot
+        self.offset = offset
+        self.keys = keys
+
+    def get(self, field: str, default=None):
+        """ Value of one field, from the index for the keys, otherwise
+        decoding the record up to that field
+        """
+        position = self.snapshot.key_positions.get(field)
+        if position is not None:
+            value = self.keys[position]
+            return default if value is None else value
+        buf = self.snapshot.buf
+        offset = self.offset + U32.size
+        for name in self.snapshot.fields:
+            value, offset = _unpack_value(buf, offset)
+            if name == field:
+                return default if value is MISSING else value
+        return default
+
+    def to_dict(self) -> dict:
+        """ Decode the whole record
+        """
+        buf = self.snapshot.buf
+        offset = self.offset + U32.size
+        record = {}
+        for field in self.snapshot.fields:
+            value, offset = _unpack_value(buf, offset)
+            if value is not MISSING:
+                record[field] = value
+        return record
+
+
+class BinarySnapshot():
+    """ Memory-mapped binary snapshot: the index is read on open, the
+    records are decoded when accessed
+    """
+
+    def __init__(self, file_path: str):
+        """ Map a snapshot file and read its string table and index
+        """
+        with open(file_path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_fields, n_keys, n_records, index_offset = \
+            HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a binary snapshot: {}".format(file_path))
+
+        offset = HEADER.size
+        self.fields = []
+        for _ in range(n_fields):
+            length, = U16.unpack_from(self.buf, offset)
+            offset += U16.size
+            self.fields.append(str(self.buf[offset:offset + length],
+                                   'utf-8'))
+            offset += length
+        self.key_positions = {key: i
+                              for i, key in enumerate(self.fields[:n_keys])}
+
+        offset = index_offset + U64.size * n_records
+        offsets = array.array('Q')
+        offsets.frombytes(self.buf[index_offset:offset])
+        columns = []
+        for _ in range(n_keys):
+            length, = U32.unpack_from(self.buf, offset)
+            offset += U32.size
+            columns.append(codec.loads(self.buf[offset:offset + length]))
+            offset += length
+        self.records = {keys[0]: SnapshotRecord(self, record_offset, keys)
+                        for record_offset, keys
+                        in zip(offsets, zip(*columns))}
+
+    def get(self, obj_id: str) -> dict:
+        """ Decoded record of an ID, None if not found
+        """
+        record = self.records.get(obj_id)
+        if record is None:
+            return None
+        return record.to_dict()
+
+
+def json_to_binary(json_path: str, binary_path: str, keys: Iterable[str]):
+    """ Convert a .db_<Class>.json snapshot to the binary format
+    """
+    from models.engine import read_snapshot, write_atomically
+    with open(json_path, 'r') as f:
+        objs_json = codec.loads(read_snapshot(f.read(), json_path))
+    write_atomically(binary_path, dumps(list(objs_json.values()), keys))
+
+
+def binary_to_json(binary_path: str, json_path: str):
+    """ Convert a binary snapshot to the .db_<Class>.json format
+    """
+    from models.engine import write_atomically
+    snapshot = BinarySnapshot(binary_path)
+    objs_json = {obj_id: record.to_dict()
+                 for obj_id, record in snapshot.records.items()}
+    write_atomically(json_path, codec.dumps(objs_json))
+
+
+def main():
+    """ Convert the snapshot of a model class (models.<class>.<Class>)
+    between .db_<Class>.json and .db_<Class>.bin
+    """
+    if len(sys.argv) != 3 or sys.argv[1] not in ('to-binary', 'to-json'):
+        print("Usage: python3 -m models.snapshot to-binary|to-json <Class>")
+        sys.exit(1)
+    s_class = sys.argv[2]
+    json_path = ".db_{}.json".format(s_class)
+    binary_path = ".db_{}.bin".format(s_class)
+    if sys.argv[1] == 'to-binary':
+        module = importlib.import_module("models.{}".format(s_class.lower()))
+        cls = getattr(module, s_class)
+        json_to_binary(json_path, binary_path,
+                       ('id',) + tuple(cls.INDEXED_ATTRIBUTES))
+    else:
+        binary_to_json(binary_path, json_path)
+
+
+if __name__ == "__main__":
+    main()
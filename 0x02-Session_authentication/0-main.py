@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+""" Main file: concurrent saves must all reach the disk
+
+Usage: ./0-main.py [bursts] [threads] [saves per thread] [users]
+
+Every burst, threads create, update and remove users concurrently; once
+they are done, the store is reloaded by a new process (as after a
+restart) and must hold exactly what this process holds in memory, and
+none of the removed users. It runs in a
+temporary directory, MODELS_STORAGE, MODELS_ENGINE and the other
+MODELS_* variables select the store being checked.
+"""
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+from models import base
+from models.user import User
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = tempfile.mkdtemp(prefix="models-stress-")
+os.chdir(WORK_DIR)
+BURSTS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+SAVES = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+USERS = int(sys.argv[4]) if len(sys.argv) > 4 else 2000
+RESTART = "\n".join((
+    "import json",
+    "from models.user import User",
+    "User.load_from_file()",
+    "print(json.dumps({u.id: u.first_name for u in User.all()}))",
+))
+
+
+def in_memory() -> dict:
+    """ first_name of every user of this process
+    """
+    return {user.id: user.first_name for user in User.all()}
+
+
+def on_disk() -> dict:
+    """ first_name of every user, as loaded by a new process
+    """
+    env = dict(os.environ, PYTHONPATH=APP_DIR)
+    output = subprocess.run([sys.executable, "-c", RESTART], env=env,
+                            stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output)
+
+
+def worker(burst: int, thread: int, users: list,
+           barrier: threading.Barrier, removed: list):
+    """ Create a user, update a random one or remove one, SAVES times,
+    every thread saving at the same time. Users of the odd indexes are
+    only ever removed, each by a single thread, so that no update brings
+    a removed user back
+    """
+    rng = random.Random(burst * THREADS + thread)
+    updatable = users[::2]
+    removable = users[1::2][thread::THREADS]
+    rng.shuffle(removable)
+    for i in range(SAVES):
+        barrier.wait()
+        name = "b{}-t{}-{}".format(burst, thread, i)
+        draw = rng.random()
+        if draw < 0.2 and removable:
+            user = removable.pop()
+            user.remove()
+            removed.append(user.id)
+            continue
+        if draw < 0.6 or not updatable:
+            user = User(email="{}@stress".format(name))
+        else:
+            user = rng.choice(updatable)
+        user.first_name = name
+        user.save()
+
+
+# start from a store of USERS users, written in one go
+initial = {}
+for i in range(USERS):
+    user = User(email="user{}@stress".format(i), first_name="initial")
+    initial[user.id] = user.to_json(True)
+with open(".db_User.json", "w") as f:
+    json.dump(initial, f)
+if getattr(base.ENGINE, 'snapshot_format', 'json') == 'binary':
+    from models.snapshot import json_to_binary
+    json_to_binary(".db_User.json", ".db_User.bin",
+                   ('id',) + tuple(User.INDEXED_ATTRIBUTES))
+User.load_from_file()
+
+failures = 0
+for burst in range(BURSTS):
+    users = User.all()
+    barrier = threading.Barrier(THREADS)
+    removed = []
+    threads = [threading.Thread(target=worker,
+                                args=(burst, t, users, barrier, removed))
+               for t in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    User.flush()
+
+    expected = in_memory()
+    found = on_disk()
+    missing = [obj_id for obj_id in expected if obj_id not in found]
+    stale = [obj_id for obj_id in expected
+             if obj_id in found and found[obj_id] != expected[obj_id]]
+    revived = [obj_id for obj_id in removed
+               if obj_id in found or obj_id in expected]
+    ok = not missing and not stale and not revived and \
+        len(found) == len(expected)
+    failures += not ok
+    print("burst {:>3}: {} users, {} removed, {} missing on disk, {} stale, "
+          "{} removed but found  {}".format(
+              burst, len(expected), len(removed), len(missing), len(stale),
+              len(revived), "OK" if ok else "FAIL"))
+
+print("{} of {} bursts lost writes".format(failures, BURSTS))
+User.flush()
+os.chdir(APP_DIR)
+shutil.rmtree(WORK_DIR)
+sys.exit(1 if failures else 0)
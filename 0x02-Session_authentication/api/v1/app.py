@@ -1,83 +1,94 @@
 #!/usr/bin/env python3
 """
-Module for handling authentication mechanisms.
+Route module for the API
 """
-
-from typing import List, TypeVar
-from flask import request
-import os
-
-
-class Auth:
-    """
-    Manages authentication processes, including path exclusion,
-    authorization headers, and session cookies.
-    """
-
-    def require_auth(self, path: str, excluded_paths: List[str]) -> bool:
-        """
-        Determines if the given path requires authentication.
-
-        Args:
-            path (str): The path to be checked.
-            excluded_paths (List[str]): A list of paths that do not require authentication.
-
-        Returns:
-            bool: True if the path requires authentication, False otherwise.
-        """
-        if path is None:
-            return True
-
-        if excluded_paths is None or not excluded_paths:
-            return True
-
-        for excluded_path in excluded_paths:
-            if excluded_path.endswith("*") and path.startswith(excluded_path[:-1]):
-                return False
-            if path == excluded_path or path.startswith(excluded_path):
-                return False
-
-        return True
-
-    def authorization_header(self, request=None) -> str:
-        """
-        Retrieves the 'Authorization' header from the given request.
-
-        Args:
-            request (optional): The request object from which to extract the header.
-
-        Returns:
-            str: The value of the 'Authorization' header, or None if not present.
-        """
-        if request is None:
-            return None
-
-        return request.headers.get('Authorization')
-
-    def current_user(self, request=None) -> TypeVar('User'):
-        """
-        Placeholder method to return the current user. To be implemented by subclasses.
-
-        Args:
-            request (optional): The request object for retrieving user information.
-
-        Returns:
-            User: The current user, if identified; None otherwise.
-        """
-        return None
-
-    def session_cookie(self, request=None):
-        """
-        Retrieves the session cookie from the request.
-
-        Args:
-            request (optional): The request object from which to extract the session cookie.
-
-        Returns:
-            The session cookie value, or None if not present.
-        """
-        if request is None:
-            return None
-
-        session_name = os.getenv('SESSION_NAME')
-        return request.cookies.get(session_name)
+from os import getenv
+from api.v1.views import app_views
+from flask import Flask, jsonify, abort, request
+from flask_cors import CORS
+from api.v1.auth.auth import Auth, ExclusionMatcher
+from api.v1.auth.basic_auth import BasicAuth
+from api.v1.auth.session_auth import SessionAuth
+from models.base import LOOKUPS
+import threading
+
+app = Flask(__name__)
+app.register_blueprint(app_views)
+CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
+
+auth = None
+auth_type = getenv('AUTH_TYPE')
+
+if auth_type == 'session_auth':
+    auth = SessionAuth()
+elif auth_type == 'basic_auth':
+    auth = BasicAuth()
+else:
+    auth = Auth()
+
+excluded_paths = ExclusionMatcher(['/api/v1/status/', '/api/v1/unauthorized/',
+                                   '/api/v1/forbidden/',
+                                   '/api/v1/auth_session/login/'])
+
+# API_REQUEST_COUNTERS=1: X-Auth-Resolutions and X-Store-Lookups headers
+# on each response, and totals per endpoint in request_counters
+counters_enabled = getenv('API_REQUEST_COUNTERS', '0') == '1'
+request_counters = {}
+request_counters_lock = threading.Lock()
+
+
+@app.errorhandler(404)
+def not_found(error) -> str:
+    """ Not found handler """
+    return jsonify({"error": "Not found"}), 404
+
+
+@app.errorhandler(401)
+def unauthorized(error) -> str:
+    """ Unauthorized handler """
+    return jsonify({"error": "Unauthorized"}), 401
+
+
+@app.errorhandler(403)
+def forbidden(error) -> str:
+    """ Forbidden handler """
+    return jsonify({"error": "Forbidden"}), 403
+
+
+@app.before_request
+def before_request():
+    """ Filter each request before processing """
+    LOOKUPS.count = 0
+    if auth is None or not auth.require_auth(request.path, excluded_paths):
+        request.current_user = None
+        return
+    if auth.authorization_header(request) is None and \
+            auth.session_cookie(request) is None:
+        abort(401)
+    if auth.resolve_user(request) is None:
+        abort(403)
+
+
+@app.after_request
+def after_request(response):
+    """ Report the auth resolutions and store lookups of the request """
+    if not counters_enabled:
+        return response
+    resolutions = getattr(request, 'auth_resolutions', 0)
+    lookups = getattr(LOOKUPS, 'count', 0)
+    with request_counters_lock:
+        totals = request_counters.setdefault(
+            request.endpoint,
+            {'requests': 0, 'auth_resolutions': 0, 'store_lookups': 0})
+        totals['requests'] += 1
+        totals['auth_resolutions'] += resolutions
+        totals['store_lookups'] += lookups
+    response.headers['X-Auth-Resolutions'] = str(resolutions)
+    response.headers['X-Store-Lookups'] = str(lookups)
+    return response
+
+
+if __name__ == "__main__":
+    host = getenv("API_HOST", "0.0.0.0")
+    port = getenv("API_PORT", "5000")
+    app.run(host=host, port=port)
@@ -3,12 +3,71 @@
 """
 from api.v1.auth.auth import Auth
 from base64 import b64decode
+from collections import OrderedDict
+from os import getenv
 from typing import TypeVar
 from models.user import User
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+CACHE_TTL = float(getenv('BASIC_AUTH_CACHE_TTL', '60'))
+CACHE_SIZE = int(getenv('BASIC_AUTH_CACHE_SIZE', '10000'))
+
 
 class BasicAuth(Auth):
     """ Basic Authentication Class """
 
+    def __init__(self):
+        """ Initialize an empty cache of verified credentials: keyed
+        digest of the Authorization header -> (user ID, email, password
+        hash, expiry) """
+        self._credentials = OrderedDict()
+        self._credentials_lock = threading.Lock()
+        self._credentials_key = os.urandom(32)
+
+    def _credentials_digest(self, authorization_header: str) -> bytes:
+        """ Digest of a header under a per-process key, so that the cache
+        never holds credentials """
+        return hmac.new(self._credentials_key, authorization_header.encode(),
+                        hashlib.sha256).digest()
+
+    def cached_user(self, authorization_header: str) -> TypeVar('User'):
+        """ Returns the User verified for this header less than CACHE_TTL
+        seconds ago, if its email and password did not change and it was
+        not removed since """
+        digest = self._credentials_digest(authorization_header)
+        with self._credentials_lock:
+            entry = self._credentials.get(digest)
+            if entry is None:
+                return None
+            if entry[3] <= time.monotonic():
+                del self._credentials[digest]
+                return None
+            self._credentials.move_to_end(digest)
+
+        user = User.get(entry[0])
+        if user is None or user.email != entry[1] or \
+                user.password != entry[2]:
+            with self._credentials_lock:
+                self._credentials.pop(digest, None)
+            return None
+        return user
+
+    def cache_user(self, authorization_header: str, user: TypeVar('User')):
+        """ Remembers the User verified for this header, evicting the least
+        recently used entry beyond CACHE_SIZE """
+        digest = self._credentials_digest(authorization_header)
+        entry = (user.id, user.email, user.password,
+                 time.monotonic() + CACHE_TTL)
+        with self._credentials_lock:
+            self._credentials[digest] = entry
+            self._credentials.move_to_end(digest)
+            if len(self._credentials) > CACHE_SIZE:
+                self._credentials.popitem(last=False)
+
     def extract_base64_authorization_header(self, authorization_header: str) -> str:
         """ Extracts the Base64 part of the Authorization header for Basic Authentication """
         if authorization_header is None or not isinstance(authorization_header, str):
@@ -58,6 +117,10 @@ class BasicAuth(Auth):
         auth_header = self.authorization_header(request)
         if auth_header is None:
             return None
+
+        user = self.cached_user(auth_header)
+        if user is not None:
+            return user
         
         base64_header = self.extract_base64_authorization_header(auth_header)
         if base64_header is None:
@@ -71,4 +134,7 @@ class BasicAuth(Auth):
         if user_email is None or user_pwd is None:
             return None
         
-        return self.user_object_from_credentials(user_email, user_pwd)
+        user = self.user_object_from_credentials(user_email, user_pwd)
+        if user is not None:
+            self.cache_user(auth_header, user)
+        return user
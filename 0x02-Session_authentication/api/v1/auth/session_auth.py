@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 """Module for Session Authentication management."""
 from api.v1.auth.auth import Auth
+from api.v1.auth.session_store import get_session_store
 from models.user import User
+from os import getenv
 import uuid
 
 
 class SessionAuth(Auth):
     """Handles session-based authentication."""
 
-    user_id_by_session_id = {}
+    # SESSION_STORE: "memory" (default) or "sqlite", sessions expiring
+    # after SESSION_DURATION seconds
+    user_id_by_session_id = get_session_store(
+        getenv('SESSION_STORE', 'memory'))
 
     def create_session(self, user_id: str = None) -> str:
         """
@@ -24,7 +29,7 @@ class SessionAuth(Auth):
             return None
 
         session_id = str(uuid.uuid4())
-        self.user_id_by_session_id[session_id] = user_id
+        self.user_id_by_session_id.set(session_id, user_id)
         return session_id
 
     def user_id_for_session_id(self, session_id: str = None) -> str:
@@ -80,9 +85,4 @@ class SessionAuth(Auth):
         if not user_id:
             return False
 
-        try:
-            del self.user_id_by_session_id[session_id]
-        except KeyError:
-            return False
-
-        return True
+        return self.user_id_by_session_id.delete(session_id)
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+"""Module for the session stores of SessionAuth."""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from os import getenv
+import atexit
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+
+SESSION_DURATION = float(getenv('SESSION_DURATION', '86400'))
+SESSION_SLIDING = getenv('SESSION_SLIDING', '0') == '1'
+SESSION_CAPACITY = int(getenv('SESSION_CAPACITY', '100000'))
+SWEEP_BATCH = 64
+SESSION_DB_PATH = getenv('SESSION_DB_PATH', '.db_sessions.sqlite3')
+SESSION_FLUSH_MS = int(getenv('SESSION_FLUSH_MS', '50'))
+SESSION_FLUSH_MAX = int(getenv('SESSION_FLUSH_MAX', '100'))
+
+
+class SessionStore(ABC):
+    """
+    Interface of the session stores: a mapping of session IDs to user
+    IDs where sessions expire.
+    """
+
+    @abstractmethod
+    def set(self, session_id: str, user_id: str, duration: float = None):
+        """
+        Stores a session, replacing any session with the same ID.
+
+        Args:
+            session_id (str): The session ID.
+            user_id (str): The ID of the user of the session.
+            duration (float): Lifetime of this session in seconds,
+                defaults to the lifetime of the store.
+        """
+
+    @abstractmethod
+    def get(self, session_id: str, default=None) -> str:
+        """
+        Looks up the user ID of a live session.
+
+        Args:
+            session_id (str): The session ID.
+            default: Value returned for unknown or expired sessions.
+
+        Returns:
+            str: The user ID of the session, or default.
+        """
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """
+        Deletes a session.
+
+        Args:
+            session_id (str): The session ID.
+
+        Returns:
+            bool: True if a live session was deleted, False otherwise.
+        """
+
+    def __setitem__(self, session_id: str, user_id: str):
+        """Stores a session with the default lifetime."""
+        self.set(session_id, user_id)
+
+    def __getitem__(self, session_id: str) -> str:
+        """Looks up the user ID of a live session, raising KeyError."""
+        user_id = self.get(session_id)
+        if user_id is None:
+            raise KeyError(session_id)
+        return user_id
+
+    def __delitem__(self, session_id: str):
+        """Deletes a live session, raising KeyError."""
+        if not self.delete(session_id):
+            raise KeyError(session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        """Checks if a session is live."""
+        return self.get(session_id) is not None
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-memory mapping of session IDs to user IDs, with a TTL per session,
+    optional sliding expiration and a capacity enforced by evicting the
+    least recently used session.
+
+    Expired sessions are never returned. They are also deleted a few at
+    a time on each write: sessions are filed in one-second buckets of
+    their expiry time, and a heap of bucket times gives the oldest bucket
+    without scanning the store.
+    """
+
+    def __init__(self, duration: float = SESSION_DURATION,
+                 sliding: bool = SESSION_SLIDING,
+                 capacity: int = SESSION_CAPACITY):
+        """
+        Initializes an empty store.
+
+        Args:
+            duration (float): Default lifetime of a session in seconds,
+                0 for sessions that never expire.
+            sliding (bool): Whether each lookup extends the session by
+                its lifetime.
+            capacity (int): Maximum number of sessions, 0 for no limit.
+        """
+        self.duration = duration
+        self.sliding = sliding
+        self.capacity = capacity
+        # session ID -> [user ID, expiry time or None, lifetime]
+        self._sessions = OrderedDict()
+        # expiry bucket -> session IDs expiring in it, empty buckets are
+        # dropped so that their sets do not keep their peak size
+        self._buckets = {}
+        self._bucket_heap = []
+        self._scheduled = set()
+        self._lock = threading.Lock()
+
+    def _file(self, session_id: str, expires_at: float):
+        """
+        Adds a session to the bucket of its expiry time.
+
+        Args:
+            session_id (str): The session ID.
+            expires_at (float): Its expiry time, None if it never expires.
+        """
+        if expires_at is None:
+            return
+        bucket = int(expires_at) + 1
+        ids = self._buckets.get(bucket)
+        if ids is None:
+            ids = self._buckets[bucket] = set()
+            if bucket not in self._scheduled:
+                self._scheduled.add(bucket)
+                heapq.heappush(self._bucket_heap, bucket)
+        ids.add(session_id)
+
+    def _unfile(self, session_id: str, expires_at: float):
+        """
+        Removes a session from the bucket of its expiry time.
+
+        Args:
+            session_id (str): The session ID.
+            expires_at (float): Its expiry time, None if it never expires.
+        """
+        if expires_at is None:
+            return
+        bucket = int(expires_at) + 1
+        ids = self._buckets.get(bucket)
+        if ids is not None:
+            ids.discard(session_id)
+            if not ids:
+                del self._buckets[bucket]
+
+    def _sweep(self, now: float):
+        """
+        Deletes up to SWEEP_BATCH expired sessions or buckets, oldest
+        first.
+
+        Args:
+            now (float): The current time.
+        """
+        budget = SWEEP_BATCH
+        while budget > 0 and self._bucket_heap and \
+                self._bucket_heap[0] <= now:
+            bucket = self._bucket_heap[0]
+            ids = self._buckets.get(bucket)
+            while ids and budget > 0:
+                self._sessions.pop(ids.pop(), None)
+                budget -= 1
+            if ids:
+                return
+            heapq.heappop(self._bucket_heap)
+            self._scheduled.discard(bucket)
+            self._buckets.pop(bucket, None)
+            budget -= 1
+
+    def set(self, session_id: str, user_id: str, duration: float = None):
+        """
+        Stores a session, replacing any session with the same ID.
+
+        Args:
+            session_id (str): The session ID.
+            user_id (str): The ID of the user of the session.
+            duration (float): Lifetime of this session in seconds,
+                defaults to the lifetime of the store.
+        """
+        if duration is None:
+            duration = self.duration
+        now = time.time()
+        expires_at = now + duration if duration > 0 else None
+        with self._lock:
+            self._sweep(now)
+            entry = self._sessions.pop(session_id, None)
+            if entry is not None:
+                self._unfile(session_id, entry[1])
+            self._sessions[session_id] = [user_id, expires_at, duration]
+            self._file(session_id, expires_at)
+            if self.capacity and len(self._sessions) > self.capacity:
+                old_id, old_entry = self._sessions.popitem(last=False)
+                self._unfile(old_id, old_entry[1])
+
+    def get(self, session_id: str, default=None) -> str:
+        """
+        Looks up the user ID of a live session, marking it as recently
+        used and extending it when expiration is sliding.
+
+        Args:
+            session_id (str): The session ID.
+            default: Value returned for unknown or expired sessions.
+
+        Returns:
+            str: The user ID of the session, or default.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return default
+            now = time.time()
+            if entry[1] is not None and entry[1] <= now:
+                del self._sessions[session_id]
+                self._unfile(session_id, entry[1])
+                return default
+            self._sessions.move_to_end(session_id)
+            if self.sliding and entry[1] is not None:
+                self._unfile(session_id, entry[1])
+                entry[1] = now + entry[2]
+                self._file(session_id, entry[1])
+            return entry[0]
+
+    def delete(self, session_id: str) -> bool:
+        """
+        Deletes a session.
+
+        Args:
+            session_id (str): The session ID.
+
+        Returns:
+            bool: True if a live session was deleted, False otherwise.
+        """
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None:
+                return False
+            self._unfile(session_id, entry[1])
+            return entry[1] is None or entry[1] > time.time()
+
+    def __len__(self) -> int:
+        """Number of stored sessions, including expired ones not yet
+        swept."""
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions in a SQLite table shared by every worker and kept across
+    restarts, looked up by primary key.
+
+    Sessions are created and deleted in a transaction of their own before
+    set and delete return, so that every worker sees a login or a logout
+    at once. Only the extensions of sliding expiration are batched: they
+    go to a pending map, which lookups of this process apply, and a
+    background thread commits them in one transaction at most
+    SESSION_FLUSH_MS milliseconds later, or as soon as SESSION_FLUSH_MAX
+    are pending. An extension only updates a session that still exists,
+    so it never brings a deleted session back. Each commit also deletes a
+    batch of expired sessions through the index on their expiry time.
+    """
+
+    def __init__(self, db_path: str = SESSION_DB_PATH,
+                 duration: float = SESSION_DURATION,
+                 sliding: bool = SESSION_SLIDING):
+        """
+        Initializes a store on a database file, creating its table.
+
+        Args:
+            db_path (str): Path of the database file.
+            duration (float): Default lifetime of a session in seconds,
+                0 for sessions that never expire.
+            sliding (bool): Whether each lookup extends the session by
+                its lifetime.
+        """
+        self.db_path = db_path
+        self.duration = duration
+        self.sliding = sliding
+        self._local = threading.local()
+        # session ID -> (user ID, extended expiry time), until committed
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        conn = self._connection()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                         "session_id TEXT PRIMARY KEY, "
+                         "user_id TEXT NOT NULL, "
+                         "expires_at REAL, duration REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at "
+                         "ON sessions (expires_at)")
+        atexit.register(self.flush)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Returns the connection of the current thread.
+
+        Returns:
+            sqlite3.Connection: The connection, opened in WAL mode.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _extend(self, session_id: str, user_id: str, expires_at: float):
+        """
+        Queues the extension of a session for the background thread.
+
+        Args:
+            session_id (str): The session ID.
+            user_id (str): The ID of the user of the session, the
+                extension is dropped if the session was replaced since.
+            expires_at (float): The new expiry time.
+        """
+        with self._condition:
+            self._pending[session_id] = (user_id, expires_at)
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_loop,
+                                                 daemon=True,
+                                                 name="session-store")
+                self._flusher.start()
+            self._condition.notify()
+
+    def _flush_loop(self):
+        """
+        Commits the pending extensions SESSION_FLUSH_MS milliseconds after
+        the first of them, or once SESSION_FLUSH_MAX are pending. A failed
+        commit (e.g. the database stayed locked) keeps them pending and
+        is retried SESSION_FLUSH_MS milliseconds later.
+        """
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = time.monotonic() + SESSION_FLUSH_MS / 1000
+                while len(self._pending) < SESSION_FLUSH_MAX:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            try:
+                self.flush()
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "Session store commit failed, retrying in %d ms",
+                    SESSION_FLUSH_MS)
+                time.sleep(SESSION_FLUSH_MS / 1000)
+
+    def _sweep(self, conn: sqlite3.Connection):
+        """
+        Deletes up to SWEEP_BATCH expired sessions, in the transaction
+        of a commit.
+
+        Args:
+            conn (sqlite3.Connection): The connection of the commit.
+        """
+        conn.execute(
+            "DELETE FROM sessions WHERE rowid IN (SELECT rowid "
+            "FROM sessions WHERE expires_at <= ? LIMIT ?)",
+            (time.time(), SWEEP_BATCH))
+
+    def flush(self):
+        """
+        Commits the pending extensions in one transaction, with a batch of
+        deletions of expired sessions.
+        """
+        with self._flush_lock:
+            with self._condition:
+                batch = dict(self._pending)
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "UPDATE sessions SET expires_at = ? "
+                    "WHERE session_id = ? AND user_id = ?",
+                    [(expires_at, session_id, user_id)
+                     for session_id, (user_id, expires_at) in batch.items()])
+                self._sweep(conn)
+            with self._condition:
+                for session_id, entry in batch.items():
+                    if self._pending.get(session_id, 0) is entry:
+                        del self._pending[session_id]
+
+    def _entry(self, session_id: str) -> tuple:
+        """
+        Returns the current state of a session, with its pending
+        extension.
+
+        Args:
+            session_id (str): The session ID.
+
+        Returns:
+            tuple: (user ID, expiry time, lifetime), or None.
+        """
+        entry = self._connection().execute(
+            "SELECT user_id, expires_at, duration FROM sessions "
+            "WHERE session_id = ?", (session_id,)).fetchone()
+        if entry is None:
+            return None
+        with self._condition:
+            pending = self._pending.get(session_id)
+        if pending is not None and pending[0] == entry[0]:
+            return (entry[0], pending[1], entry[2])
+        return entry
+
+    def set(self, session_id: str, user_id: str, duration: float = None):
+        """
+        Stores a session, replacing any session with the same ID.
+
+        Args:
+            session_id (str): The session ID.
+            user_id (str): The ID of the user of the session.
+            duration (float): Lifetime of this session in seconds,
+                defaults to the lifetime of the store.
+        """
+        if duration is None:
+            duration = self.duration
+        expires_at = time.time() + duration if duration > 0 else None
+        # under the flush lock, so that no batch read before this write
+        # is committed after it
+        with self._flush_lock:
+            with self._condition:
+                self._pending.pop(session_id, None)
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sessions "
+                    "(session_id, user_id, expires_at, duration) "
+                    "VALUES (?, ?, ?, ?)",
+                    (session_id, user_id, expires_at, duration))
+                self._sweep(conn)
+
+    def get(self, session_id: str, default=None) -> str:
+        """
+        Looks up the user ID of a live session, extending it when
+        expiration is sliding.
+
+        Args:
+            session_id (str): The session ID.
+            default: Value returned for unknown or expired sessions.
+
+        Returns:
+            str: The user ID of the session, or default.
+        """
+        entry = self._entry(session_id)
+        if entry is None:
+            return default
+        user_id, expires_at, duration = entry
+        now = time.time()
+        if expires_at is not None and expires_at <= now:
+            return default
+        if self.sliding and expires_at is not None:
+            self._extend(session_id, user_id, now + duration)
+        return user_id
+
+    def delete(self, session_id: str) -> bool:
+        """
+        Deletes a session.
+
+        Args:
+            session_id (str): The session ID.
+
+        Returns:
+            bool: True if a live session was deleted, False otherwise.
+        """
+        with self._flush_lock:
+            entry = self._entry(session_id)
+            if entry is None:
+                return False
+            with self._condition:
+                self._pending.pop(session_id, None)
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM sessions WHERE session_id = ?",
+                             (session_id,))
+        return entry[1] is None or entry[1] > time.time()
+
+    def __len__(self) -> int:
+        """Number of stored sessions, including expired ones not yet
+        swept."""
+        self.flush()
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+SESSION_STORES = {
+    'memory': MemorySessionStore,
+    'sqlite': SQLiteSessionStore,
+}
+
+
+def get_session_store(name: str) -> SessionStore:
+    """
+    Creates the session store selected by name.
+
+    Args:
+        name (str): "memory" or "sqlite".
+
+    Returns:
+        SessionStore: A new store.
+    """
+    if name not in SESSION_STORES:
+        raise ValueError("Unknown session store: {}".format(name))
+    return SESSION_STORES[name]()
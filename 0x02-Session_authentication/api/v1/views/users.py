@@ -2,7 +2,8 @@
 """ Module for Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, jsonify, request
+from models import codec
 from models.user import User
 
 
@@ -13,7 +14,9 @@ def view_all_users() -> str:
       - List of all User objects in JSON format
     """
     all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    # same body as jsonify, serialized with the fastest codec installed
+    return Response(codec.dumps(all_users, sort_keys=True) + "\n",
+                    mimetype="application/json")
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+""" JSON codec module
+"""
+from os import getenv
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_dumps(obj, sort_keys: bool = False) -> str:
+    """ Serialize with the standard library
+    """
+    return json.dumps(obj, sort_keys=sort_keys, separators=(",", ":"))
+
+
+def orjson_dumps(obj, sort_keys: bool = False) -> str:
+    """ Serialize with orjson, or with the standard library for what
+    orjson refuses (non-string keys, integers over 64 bits...)
+    """
+    option = orjson.OPT_SORT_KEYS if sort_keys else 0
+    try:
+        return orjson.dumps(obj, option=option).decode()
+    except TypeError:
+        return json_dumps(obj, sort_keys)
+
+
+CODECS = {
+    'json': (json_dumps, json.loads),
+}
+if orjson is not None:
+    CODECS['orjson'] = (orjson_dumps, orjson.loads)
+
+
+def get_codec(name: str) -> tuple:
+    """ (dumps, loads) of a codec by name, "auto" picking the fastest
+    one installed
+    """
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in CODECS else 'json'
+    if name not in CODECS:
+        raise ValueError("Unknown JSON codec: {}".format(name))
+    return CODECS[name]
+
+
+dumps, loads = get_codec(getenv('MODELS_JSON_CODEC', 'auto'))
@@ -0,0 +1,960 @@
+#!/usr/bin/env python3
+""" Storage engines module
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TypeVar, List, Iterable
+from os import getenv, path
+import atexit
+import fcntl
+import hashlib
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from models import codec
+from models.snapshot import BinarySnapshot, SnapshotRecord
+from models.snapshot import dumps as dumps_binary
+
+
+CHECKSUM_PREFIX = "\n#sha256 "
+RAW_RECORDS = (dict, SnapshotRecord)
+
+
+def write_atomically(file_path: str, content):
+    """ Write a file through a fsynced temporary file renamed into place,
+    so readers and crashes only ever see the old or the new content
+    """
+    tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+    with open(tmp_path, 'wb' if type(content) is bytes else 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+    dir_fd = os.open(path.dirname(path.abspath(file_path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def read_snapshot(content: str, file_path: str) -> str:
+    """ Strip and verify the optional checksum trailer of a snapshot
+    """
+    body, found, digest = content.rpartition(CHECKSUM_PREFIX)
+    if not found:
+        return content
+    if hashlib.sha256(body.encode()).hexdigest() != digest.strip():
+        raise ValueError("Checksum mismatch in {}".format(file_path))
+    return body
+
+
+def attribute_of(value, attribute: str):
+    """ Attribute of an object or of the raw record of a lazy object
+    """
+    if type(value) in RAW_RECORDS:
+        return value.get(attribute)
+    return getattr(value, attribute, None)
+
+
+@contextmanager
+def _nothing():
+    """ Context manager doing nothing
+    """
+    yield
+
+
+class ReadWriteLock():
+    """ Lock shared by readers and exclusive for writers, waiting writers
+    go before new readers
+    """
+
+    def __init__(self):
+        """ Initialize an unlocked lock
+        """
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        """ Hold the lock shared for the duration of the block
+        """
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        """ Hold the lock exclusively for the duration of the block
+        """
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class HashIndex():
+    """ Secondary index: attribute value -> IDs of the objects
+    """
+
+    def __init__(self):
+        """ Initialize an empty index
+        """
+        self.ids = {}
+        self.values = {}
+
+    def add(self, obj_id: str, value):
+        """ Index an object, replacing its previous value if any
+        """
+        self.discard(obj_id)
+        self.values[obj_id] = value
+        self.ids.setdefault(value, {})[obj_id] = None
+
+    def discard(self, obj_id: str):
+        """ Remove an object from the index
+        """
+        if obj_id not in self.values:
+            return
+        value = self.values.pop(obj_id)
+        ids = self.ids[value]
+        del ids[obj_id]
+        if len(ids) == 0:
+            del self.ids[value]
+
+    def lookup(self, value) -> List[str]:
+        """ IDs of the objects indexed with this value
+        """
+        return list(self.ids.get(value, ()))
+
+
+class StorageEngine(ABC):
+    """ Interface of the stores Base delegates persistence to
+    """
+
+    @abstractmethod
+    def load(self, cls):
+        """ Prepare the storage of a class
+        """
+
+    @abstractmethod
+    def save_all(self, cls):
+        """ Make every saved object of a class durable
+        """
+
+    @abstractmethod
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or replace an object
+        """
+
+    @abstractmethod
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete an object
+        """
+
+    @abstractmethod
+    def count(self, cls) -> int:
+        """ Number of objects of a class
+        """
+
+    @abstractmethod
+    def get(self, cls, id: str) -> TypeVar('Base'):
+        """ Object of a class by ID, None if not found
+        """
+
+    @abstractmethod
+    def search(self, cls, attributes: dict) -> List[TypeVar('Base')]:
+        """ Objects of a class with matching attributes
+        """
+
+    def flush(self, cls):
+        """ Write the pending saves of a class now, for the engines that
+        delay them
+        """
+
+
+class JSONEngine(StorageEngine):
+    """ Objects held in memory (data: class name -> {ID -> object}) and
+    persisted to .db_<Class> files, configured by:
+
+    MODELS_STORAGE
+        "snapshot": every save rewrites .db_<Class>.json
+        "journal": every save appends one record to .db_<Class>.log,
+                   which is compacted into the snapshot every
+                   MODELS_JOURNAL_COMPACT_EVERY records
+        "write_behind": saves mark the class dirty and a background
+                        thread rewrites .db_<Class>.json at most every
+                        MODELS_WRITE_BEHIND_MS milliseconds or
+                        MODELS_WRITE_BEHIND_MAX saves
+    MODELS_SNAPSHOT_FORMAT
+        "json": .db_<Class>.json, "binary": .db_<Class>.bin
+        (models.snapshot)
+    MODELS_SHARED
+        several processes share the .db_<Class> files: writes hold an
+        advisory lock on .db_<Class>.lock and reload what the others
+        wrote first, reads reload when the files changed since this
+        process last saw them
+    MODELS_LAZY
+        load keeps the raw records and objects are only created when
+        get/search return them, the last MODELS_CACHE_SIZE of them
+        being kept in hydrated
+    """
+
+    def __init__(self):
+        """ Initialize an empty store from the MODELS_* variables
+        """
+        self.storage_mode = getenv('MODELS_STORAGE', 'snapshot')
+        self.journal_compact_every = int(
+            getenv('MODELS_JOURNAL_COMPACT_EVERY', '1000'))
+        self.fsync = getenv('MODELS_FSYNC', '0') == '1'
+        self.write_behind_ms = int(getenv('MODELS_WRITE_BEHIND_MS', '1000'))
+        self.write_behind_max = int(getenv('MODELS_WRITE_BEHIND_MAX', '100'))
+        self.checksum = getenv('MODELS_CHECKSUM', '0') == '1'
+        self.snapshot_format = getenv('MODELS_SNAPSHOT_FORMAT', 'json')
+        self.shared = getenv('MODELS_SHARED', '0') == '1'
+        self.lazy = getenv('MODELS_LAZY', '0') == '1'
+        self.cache_size = int(getenv('MODELS_CACHE_SIZE', '10000'))
+
+        self.data = {}
+        self.indexes = {}
+        self.locks = {}
+        self._locks_lock = threading.Lock()
+        self.journals = {}
+        self.journal_sizes = {}
+        # class -> {object ID -> (sequence number of the save, object or
+        # None if removed)}
+        self.dirty = {}
+        self._dirty_sequence = itertools.count(1)
+        self._dirty_condition = threading.Condition()
+        self._write_behind_lock = threading.Lock()
+        self._flusher = None
+        # snapshots are stamped in the order of the states of data they
+        # copy and serialized concurrently; a stamp older than the one on
+        # disk is not written
+        self._snapshot_stamps = itertools.count(1)
+        self.written_stamps = {}
+        self._flush_lock = threading.Lock()
+        self.generations = {}
+        self._process_locks = {}
+        self.hydrated = {}
+        self._hydrated_lock = threading.Lock()
+        atexit.register(self.flush_all)
+
+    def snapshot_path(self, s_class: str) -> str:
+        """ Path of the snapshot of a class in its snapshot format
+        """
+        if self.snapshot_format == 'binary':
+            return ".db_{}.bin".format(s_class)
+        return ".db_{}.json".format(s_class)
+
+    def generation(self, s_class: str) -> tuple:
+        """ Identify the current state of the files of a class: the
+        snapshot gets a new inode on every write, the journal grows on
+        every append
+        """
+        signature = []
+        for file_path in (self.snapshot_path(s_class),
+                          ".db_{}.log".format(s_class)):
+            try:
+                st = os.stat(file_path)
+                signature.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    @contextmanager
+    def process_lock(self, s_class: str):
+        """ Hold the advisory lock shared by every process on a class
+        """
+        with self._locks_lock:
+            thread_lock = self._process_locks.setdefault(s_class,
+                                                         threading.Lock())
+        with thread_lock:
+            fd = os.open(".db_{}.lock".format(s_class),
+                         os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
+
+    def lock_for(self, s_class: str) -> ReadWriteLock:
+        """ Return the lock guarding data and indexes of a class
+        """
+        lock = self.locks.get(s_class)
+        if lock is None:
+            with self._locks_lock:
+                lock = self.locks.setdefault(s_class, ReadWriteLock())
+        return lock
+
+    def _run_flusher(self):
+        """ Write-behind thread: flush dirty classes once write_behind_ms
+        elapsed since the first pending save, or write_behind_max saves
+        are pending. A failed flush leaves the changes dirty and is
+        retried write_behind_ms later.
+        """
+        while True:
+            with self._dirty_condition:
+                while not self.dirty:
+                    self._dirty_condition.wait()
+                deadline = time.monotonic() + self.write_behind_ms / 1000
+                while self.dirty and sum(map(len, self.dirty.values())) < \
+                        self.write_behind_max:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._dirty_condition.wait(remaining)
+            try:
+                self.flush_all()
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "Write-behind flush failed, retrying in %d ms",
+                    self.write_behind_ms)
+                time.sleep(self.write_behind_ms / 1000)
+
+    def flush_all(self):
+        """ Write the snapshot of every class with pending write-behind
+        saves, raising the first error once every class was attempted
+        """
+        # held while writing, so a flush at exit waits for the one the
+        # write-behind thread may have started
+        errors = []
+        with self._write_behind_lock:
+            with self._dirty_condition:
+                pending = list(self.dirty.keys())
+            for cls in pending:
+                try:
+                    self._write_behind(cls)
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def load(self, cls):
+        """ Load all objects of a class from its files
+        """
+        s_class = cls.__name__
+        file_path = self.snapshot_path(s_class)
+        signature = self.generation(s_class)
+        objs = {}
+        if self.snapshot_format == 'binary' and path.exists(file_path):
+            records = BinarySnapshot(file_path).records
+            if self.lazy:
+                objs = records
+            else:
+                for obj_id, record in records.items():
+                    objs[obj_id] = cls(**record.to_dict())
+        elif path.exists(file_path):
+            with open(file_path, 'r') as f:
+                objs_json = codec.loads(read_snapshot(f.read(), file_path))
+                if self.lazy:
+                    objs = objs_json
+                else:
+                    for obj_id, obj_json in objs_json.items():
+                        objs[obj_id] = cls(**obj_json)
+        self.replay_journal(cls, objs)
+        indexes = self._build_indexes(cls, objs)
+        # readers still iterating the previous dict keep a consistent view
+        with self.lock_for(s_class).write():
+            self.data[s_class] = objs
+            self.indexes[s_class] = indexes
+        self.generations[s_class] = signature
+
+    def _reload_if_changed(self, cls) -> bool:
+        """ Reload a class if another process wrote its files since this
+        process last loaded or wrote them
+        """
+        s_class = cls.__name__
+        signature = self.generation(s_class)
+        known = self.generations.get(s_class)
+        if signature == known:
+            return False
+        if known is not None and signature[0] == known[0] and \
+                None not in (signature[1], known[1]) and \
+                signature[1][0] == known[1][0] and \
+                signature[1][2] >= known[1][2]:
+            # same snapshot, the journal only grew: replay the new records
+            self._replay_journal_tail(cls, known[1][2])
+            self.generations[s_class] = signature
+        else:
+            self.load(cls)
+        self._reapply(cls)
+        return True
+
+    def refresh(self, cls):
+        """ Pick up the writes of other processes (MODELS_SHARED only)
+        """
+        if self.shared and self.generation(cls.__name__) != \
+                self.generations.get(cls.__name__):
+            with self.process_lock(cls.__name__):
+                self._reload_if_changed(cls)
+
+    @contextmanager
+    def _shared_write(self, cls):
+        """ With MODELS_SHARED, hold the process lock around a write and
+        start from the latest state on disk, so that the write merges
+        into what the other processes saved instead of overwriting it
+        """
+        if not self.shared:
+            yield
+            return
+        s_class = cls.__name__
+        with self.process_lock(s_class):
+            self._reload_if_changed(cls)
+            yield
+            self.generations[s_class] = self.generation(s_class)
+
+    def replay_journal(self, cls, objs: dict):
+        """ Apply the records of .db_<Class>.log on top of objs
+        """
+        s_class = cls.__name__
+        self.journal_sizes[s_class] = 0
+        for record in self._journal_records(cls, 0):
+            if record['op'] == 'save':
+                objs[record['id']] = record['obj'] if self.lazy \
+                    else cls(**record['obj'])
+            else:
+                objs.pop(record['id'], None)
+            self.journal_sizes[s_class] += 1
+
+    def _replay_journal_tail(self, cls, offset: int):
+        """ Apply to data the journal records appended after offset
+        """
+        s_class = cls.__name__
+        records = list(self._journal_records(cls, offset))
+        with self.lock_for(s_class).write():
+            objs = self.data.setdefault(s_class, {})
+            for record in records:
+                if objs.pop(record['id'], None) is not None:
+                    self._unindex_id(cls, record['id'])
+                if record['op'] == 'save':
+                    obj = record['obj'] if self.lazy \
+                        else cls(**record['obj'])
+                    objs[record['id']] = obj
+                    self._index_value(cls, record['id'], obj)
+            self.journal_sizes[s_class] = \
+                self.journal_sizes.get(s_class, 0) + len(records)
+
+    def _journal_records(self, cls, offset: int) -> Iterable[dict]:
+        """ Records of .db_<Class>.log from a byte offset
+        """
+        journal_path = ".db_{}.log".format(cls.__name__)
+        if not path.exists(journal_path):
+            return
+
+        with open(journal_path, 'rb+') as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    record = codec.loads(line)
+                except ValueError:
+                    record = None
+                if record is None or not line.endswith(b"\n"):
+                    # torn record of a crashed append: drop it so the
+                    # next append starts on a clean line
+                    f.truncate(offset)
+                    return
+                offset += len(line)
+                yield record
+
+    def _build_indexes(self, cls, objs: dict) -> dict:
+        """ Index objects on INDEXED_ATTRIBUTES
+        """
+        indexes = {}
+        for attribute in cls.INDEXED_ATTRIBUTES:
+            index = HashIndex()
+            for obj_id, obj in objs.items():
+                index.add(obj_id, attribute_of(obj, attribute))
+            indexes[attribute] = index
+        return indexes
+
+    def rebuild_indexes(self, cls):
+        """ Index every object of a class on INDEXED_ATTRIBUTES
+        """
+        s_class = cls.__name__
+        with self.lock_for(s_class).write():
+            self.indexes[s_class] = self._build_indexes(
+                cls, self.data.get(s_class, {}))
+
+    def _index_value(self, cls, obj_id: str, value):
+        """ Add the attribute values of an object or raw record to the
+        indexes, with the write lock held
+        """
+        s_class = cls.__name__
+        indexes = self.indexes.get(s_class)
+        if indexes is None:
+            indexes = self._build_indexes(cls, self.data.get(s_class, {}))
+            self.indexes[s_class] = indexes
+        for attribute, index in indexes.items():
+            index.add(obj_id, attribute_of(value, attribute))
+
+    def _unindex_id(self, cls, obj_id: str):
+        """ Remove an object from the indexes, with the write lock held
+        """
+        for index in self.indexes.get(cls.__name__, {}).values():
+            index.discard(obj_id)
+
+    def _hydrate(self, cls, obj_id: str, value) -> TypeVar('Base'):
+        """ Object for a value of data: a raw record of the lazy mode is
+        turned into an object, kept in the LRU cache hydrated until
+        cache_size more recent ones push it out or the record changes
+        """
+        if type(value) not in RAW_RECORDS:
+            return value
+        with self._hydrated_lock:
+            cache = self.hydrated.get(cls.__name__)
+            if cache is None:
+                cache = self.hydrated.setdefault(cls.__name__,
+                                                 OrderedDict())
+            entry = cache.get(obj_id)
+            if entry is not None and entry[0] is value:
+                cache.move_to_end(obj_id)
+                return entry[1]
+            obj = cls(**(value if type(value) is dict else value.to_dict()))
+            cache[obj_id] = (value, obj)
+            cache.move_to_end(obj_id)
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+            return obj
+
+    def snapshot(self, cls) -> List[TypeVar('Base')]:
+        """ Copy of the objects of a class (raw records for the objects
+        not saved since a lazy load), safe to iterate while other threads
+        save and remove objects
+        """
+        return self._stamped_snapshot(cls)[1]
+
+    def _stamped_snapshot(self, cls) -> tuple:
+        """ (stamp, snapshot(cls)), the stamp being taken under the lock
+        so that a later state of data always gets a greater one
+        """
+        s_class = cls.__name__
+        with self.lock_for(s_class).read():
+            objs = list(self.data.get(s_class, {}).values())
+            return next(self._snapshot_stamps), objs
+
+    def save_all(self, cls):
+        """ Save all objects of a class to its snapshot
+        """
+        self._write_snapshot(cls, *self._stamped_snapshot(cls))
+
+    def _write_snapshot(self, cls, stamp: int,
+                        objs: List[TypeVar('Base')]):
+        """ Serialize objects to .db_<Class>.json or .db_<Class>.bin,
+        unless a snapshot stamped later was written meanwhile
+        """
+        s_class = cls.__name__
+        file_path = self.snapshot_path(s_class)
+        objs_json = {}
+        for obj in objs:
+            if type(obj) is dict:
+                objs_json[obj['id']] = obj
+            elif type(obj) is SnapshotRecord:
+                objs_json[obj.keys[0]] = obj.to_dict()
+            else:
+                objs_json[obj.id] = obj.to_json(True)
+
+        if self.snapshot_format == 'binary':
+            content = dumps_binary(list(objs_json.values()),
+                                   ('id',) + tuple(cls.INDEXED_ATTRIBUTES))
+        else:
+            content = codec.dumps(objs_json)
+        if self.checksum and self.snapshot_format != 'binary':
+            digest = hashlib.sha256(content.encode()).hexdigest()
+            content += CHECKSUM_PREFIX + digest + "\n"
+        with self._flush_lock:
+            if stamp < self.written_stamps.get(s_class, 0):
+                return
+            write_atomically(file_path, content)
+            self.written_stamps[s_class] = stamp
+
+    def append_to_journal(self, cls, op: str, obj: TypeVar('Base')):
+        """ Append one 'save' or 'remove' record to .db_<Class>.log,
+        with the write lock held so records follow the order of data
+        """
+        s_class = cls.__name__
+        record = {'op': op, 'id': obj.id}
+        if op == 'save':
+            record['obj'] = obj.to_json(True)
+
+        journal = self.journals.get(s_class)
+        if journal is None:
+            journal = open(".db_{}.log".format(s_class), 'a')
+            self.journals[s_class] = journal
+        journal.write(codec.dumps(record) + "\n")
+        journal.flush()
+        if self.fsync:
+            os.fsync(journal.fileno())
+
+        self.journal_sizes[s_class] = self.journal_sizes.get(s_class, 0) + 1
+        if self.journal_sizes[s_class] >= self.journal_compact_every:
+            self.compact(cls)
+
+    def compact(self, cls):
+        """ Write a snapshot of a class and empty its journal,
+        with the write lock held
+        """
+        s_class = cls.__name__
+        self._write_snapshot(cls, next(self._snapshot_stamps),
+                             list(self.data.get(s_class, {}).values()))
+        journal = self.journals.pop(s_class, None)
+        if journal is not None:
+            journal.close()
+        with open(".db_{}.log".format(s_class), 'w'):
+            pass
+        self.journal_sizes[s_class] = 0
+
+    def mark_dirty(self, cls, obj: TypeVar('Base'), removed: bool = False):
+        """ Schedule a write-behind snapshot of a class
+        """
+        with self._dirty_condition:
+            # a new sequence number even for an object already pending, so
+            # a flush that serialized it before this save keeps it dirty
+            self.dirty.setdefault(cls, {})[obj.id] = \
+                (next(self._dirty_sequence), None if removed else obj)
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(
+                    target=self._run_flusher, daemon=True,
+                    name="models-write-behind")
+                self._flusher.start()
+            self._dirty_condition.notify()
+
+    def flush(self, cls):
+        """ Write the pending write-behind saves of a class now
+        """
+        with self._write_behind_lock:
+            self._write_behind(cls)
+
+    def _write_behind(self, cls):
+        """ Write the snapshot for the pending write-behind changes of a
+        class (dirty: object ID -> sequence number and saved object, or
+        None if removed). Changes stay dirty until written, so a reload
+        in between puts them back on top of the other processes' state,
+        and a change saved again while writing stays for the next flush.
+        """
+        s_class = cls.__name__
+        with self.process_lock(s_class) if self.shared else _nothing():
+            if self.shared:
+                self._reload_if_changed(cls)
+            with self._dirty_condition:
+                changes = dict(self.dirty.get(cls, {}))
+            self.save_all(cls)
+            with self._dirty_condition:
+                pending = self.dirty.get(cls, {})
+                for obj_id, (sequence, _) in changes.items():
+                    entry = pending.get(obj_id)
+                    if entry is not None and entry[0] == sequence:
+                        del pending[obj_id]
+                if not pending:
+                    self.dirty.pop(cls, None)
+            if self.shared:
+                self.generations[s_class] = self.generation(s_class)
+
+    def _reapply(self, cls):
+        """ Put pending write-behind changes back on top of a freshly
+        reloaded state
+        """
+        s_class = cls.__name__
+        with self._dirty_condition:
+            changes = dict(self.dirty.get(cls, {}))
+        with self.lock_for(s_class).write():
+            objs = self.data.setdefault(s_class, {})
+            for obj_id, (_, obj) in changes.items():
+                current = objs.get(obj_id)
+                if obj is None and current is not None:
+                    del objs[obj_id]
+                    self._unindex_id(cls, obj_id)
+                elif obj is not None:
+                    objs[obj_id] = obj
+                    self._index_value(cls, obj_id, obj)
+
+    def _persist(self, cls, op: str, obj: TypeVar('Base')):
+        """ Persist a mutation according to the storage mode, once the
+        write lock is released (journal records are appended under the
+        lock)
+        """
+        if self.storage_mode == 'write_behind':
+            self.mark_dirty(cls, obj, op == 'remove')
+        elif self.storage_mode != 'journal':
+            self.save_all(cls)
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or replace an object
+        """
+        cls = obj.__class__
+        s_class = cls.__name__
+        with self._shared_write(cls):
+            with self.lock_for(s_class).write():
+                self.data.setdefault(s_class, {})[obj.id] = obj
+                self._index_value(cls, obj.id, obj)
+                if self.storage_mode == 'journal':
+                    self.append_to_journal(cls, 'save', obj)
+            self._persist(cls, 'save', obj)
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete an object
+        """
+        cls = obj.__class__
+        s_class = cls.__name__
+        with self._shared_write(cls):
+            with self.lock_for(s_class).write():
+                objs = self.data.get(s_class, {})
+                if objs.get(obj.id) is None:
+                    return
+                del objs[obj.id]
+                self._unindex_id(cls, obj.id)
+                if self.storage_mode == 'journal':
+                    self.append_to_journal(cls, 'remove', obj)
+            self._persist(cls, 'remove', obj)
+
+    def count(self, cls) -> int:
+        """ Number of objects of a class
+        """
+        self.refresh(cls)
+        return len(self.data.get(cls.__name__, {}))
+
+    def get(self, cls, id: str) -> TypeVar('Base'):
+        """ Object of a class by ID, None if not found
+        """
+        self.refresh(cls)
+        obj = self.data.get(cls.__name__, {}).get(id)
+        if obj is None:
+            return None
+        return self._hydrate(cls, id, obj)
+
+    def search(self, cls, attributes: dict) -> List[TypeVar('Base')]:
+        """ Objects of a class with matching attributes, looked up in an
+        index when one of the attributes is indexed
+        """
+        self.refresh(cls)
+        s_class = cls.__name__
+        def _search(obj):
+            if len(attributes) == 0:
+                return True
+            for k, v in attributes.items():
+                if (getattr(obj, k) != v):
+                    return False
+            return True
+
+        objs = None
+        with self.lock_for(s_class).read():
+            data = self.data.get(s_class, {})
+            indexes = self.indexes.get(s_class, {})
+            for k, v in attributes.items():
+                if k in indexes:
+                    try:
+                        ids = indexes[k].lookup(v)
+                    except TypeError:
+                        # unhashable value: nothing indexed can match it
+                        ids = []
+                    objs = [(obj_id, data[obj_id]) for obj_id in ids]
+                    break
+            if objs is None:
+                objs = list(data.items())
+
+        objs = [self._hydrate(cls, obj_id, obj) for obj_id, obj in objs]
+        return list(filter(_search, objs))
+
+
+class SQLiteEngine(StorageEngine):
+    """ One table per class in a SQLite database: the object as JSON in
+    `data`, its `id` as primary key and every INDEXED_ATTRIBUTES value in
+    an indexed column. Nothing is held in memory, lookups go to the
+    database.
+    """
+
+    SQL_TYPES = (str, int, float, bytes, type(None))
+
+    def __init__(self, db_path: str = None):
+        """ Initialize an engine on a database file
+        """
+        self.db_path = db_path or getenv('MODELS_SQLITE_PATH', '.db.sqlite3')
+        self.synchronous = 'FULL' if getenv('MODELS_FSYNC', '0') == '1' \
+            else 'NORMAL'
+        self._local = threading.local()
+        self._tables = set()
+        self._tables_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous={}".format(self.synchronous))
+            self._local.conn = conn
+        return conn
+
+    def _table(self, cls) -> str:
+        """ Name of the table of a class, created on first use.
+        The table is filled from .db_<Class>.json, if that file exists,
+        only by whoever creates it: a table emptied later stays empty.
+        """
+        s_class = cls.__name__
+        if s_class in self._tables:
+            return s_class
+        with self._tables_lock:
+            if s_class in self._tables:
+                return s_class
+            conn = self._connection()
+            with conn:
+                # the write lock makes checking and creating the table
+                # atomic between processes sharing the database
+                conn.execute("BEGIN IMMEDIATE")
+                created = conn.execute(
+                    "SELECT 1 FROM sqlite_master "
+                    "WHERE type = 'table' AND name = ?",
+                    (s_class,)).fetchone() is None
+                columns = "".join(', "{}"'.format(attribute)
+                                  for attribute in cls.INDEXED_ATTRIBUTES)
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS "{}" '
+                    '(id TEXT PRIMARY KEY, data TEXT NOT NULL{})'
+                    .format(s_class, columns))
+                for attribute in cls.INDEXED_ATTRIBUTES:
+                    conn.execute(
+                        'CREATE INDEX IF NOT EXISTS "{0}_{1}" '
+                        'ON "{0}" ("{1}")'.format(s_class, attribute))
+                if created:
+                    self._import_json(cls, conn)
+            self._tables.add(s_class)
+        return s_class
+
+    def _import_json(self, cls, conn: sqlite3.Connection):
+        """ Copy the objects of .db_<Class>.json into the table
+        """
+        file_path = ".db_{}.json".format(cls.__name__)
+        if not path.exists(file_path):
+            return
+        with open(file_path, 'r') as f:
+            objs_json = codec.loads(read_snapshot(f.read(), file_path))
+        conn.executemany(self._upsert(cls),
+                         (self._row(cls(**obj_json))
+                          for obj_json in objs_json.values()))
+
+    def _upsert(self, cls) -> str:
+        """ Statement inserting or replacing one row
+        """
+        columns = ["id", "data"] + ['"{}"'.format(attribute)
+                                    for attribute in cls.INDEXED_ATTRIBUTES]
+        return 'INSERT OR REPLACE INTO "{}" ({}) VALUES ({})'.format(
+            cls.__name__, ", ".join(columns),
+            ", ".join("?" * len(columns)))
+
+    def _row(self, obj: TypeVar('Base')) -> tuple:
+        """ Values of the row of an object
+        """
+        row = [obj.id, codec.dumps(obj.to_json(True))]
+        for attribute in obj.INDEXED_ATTRIBUTES:
+            value = getattr(obj, attribute, None)
+            row.append(value if type(value) in self.SQL_TYPES
+                       else codec.dumps(value))
+        return tuple(row)
+
+    def load(self, cls):
+        """ Create the table of a class if needed
+        """
+        self._table(cls)
+
+    def save_all(self, cls):
+        """ Every save is committed: only make sure the table exists
+        """
+        self._table(cls)
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or replace an object
+        """
+        self._table(obj.__class__)
+        conn = self._connection()
+        with conn:
+            conn.execute(self._upsert(obj.__class__), self._row(obj))
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete an object
+        """
+        table = self._table(obj.__class__)
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM "{}" WHERE id = ?'.format(table),
+                         (obj.id,))
+
+    def count(self, cls) -> int:
+        """ Number of objects of a class
+        """
+        table = self._table(cls)
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM "{}"'.format(table)).fetchone()[0]
+
+    def get(self, cls, id: str) -> TypeVar('Base'):
+        """ Object of a class by ID, None if not found
+        """
+        table = self._table(cls)
+        row = self._connection().execute(
+            'SELECT data FROM "{}" WHERE id = ?'.format(table),
+            (id,)).fetchone()
+        if row is None:
+            return None
+        return cls(**codec.loads(row[0]))
+
+    def search(self, cls, attributes: dict) -> List[TypeVar('Base')]:
+        """ Objects of a class with matching attributes: conditions on
+        `id` and INDEXED_ATTRIBUTES go to SQLite, the others are checked
+        on the loaded objects
+        """
+        table = self._table(cls)
+        conditions = []
+        params = []
+        others = {}
+        for k, v in attributes.items():
+            if (k == 'id' or k in cls.INDEXED_ATTRIBUTES) and \
+                    type(v) in self.SQL_TYPES:
+                conditions.append('"{}" IS ?'.format(k))
+                params.append(v)
+            else:
+                others[k] = v
+        query = 'SELECT data FROM "{}"'.format(table)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        result = []
+        for row in self._connection().execute(query, params):
+            obj = cls(**codec.loads(row[0]))
+            if all(getattr(obj, k) == v for k, v in others.items()):
+                result.append(obj)
+        return result
+
+
+ENGINES = {
+    'json': JSONEngine,
+    'sqlite': SQLiteEngine,
+}
+
+
+def get_engine(name: str) -> StorageEngine:
+    """ Engine selected by name, a key of ENGINES
+    """
+    if name not in ENGINES:
+        raise ValueError("Unknown storage engine: {}".format(name))
+    return ENGINES[name]()
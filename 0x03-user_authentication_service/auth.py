@@ -3,6 +3,8 @@
 Auth module for managing user authentication, session handling, and password reset.
 """
 
+import os
+import time
 import bcrypt
 from db import DB
 from user import User
@@ -11,6 +13,44 @@ from uuid import uuid4
 from typing import Union
 
 
+def _calibrate_rounds(budget_ms: float) -> int:
+    """
+    Picks the highest bcrypt cost whose hash time fits the budget.
+
+    Args:
+        budget_ms (float): Target time for a single hash, in milliseconds.
+
+    Returns:
+        int: The number of rounds to use (at least 4).
+    """
+    rounds = 4
+    while rounds < 31:
+        start = time.perf_counter()
+        bcrypt.hashpw(b'calibration', bcrypt.gensalt(rounds + 1))
+        if (time.perf_counter() - start) * 1000 > budget_ms:
+            break
+        rounds += 1
+    return rounds
+
+
+def _bcrypt_rounds() -> int:
+    """
+    Reads the bcrypt cost from the environment: BCRYPT_ROUNDS if set,
+    otherwise calibrated for BCRYPT_BUDGET_MS if set, otherwise 12.
+
+    Returns:
+        int: The number of rounds to use.
+    """
+    if os.getenv('BCRYPT_ROUNDS'):
+        return int(os.getenv('BCRYPT_ROUNDS'))
+    if os.getenv('BCRYPT_BUDGET_MS'):
+        return _calibrate_rounds(float(os.getenv('BCRYPT_BUDGET_MS')))
+    return 12
+
+
+BCRYPT_ROUNDS = _bcrypt_rounds()
+
+
 def _hash_password(password: str) -> bytes:
     """
     Hashes the provided password using bcrypt.
@@ -21,7 +61,23 @@ def _hash_password(password: str) -> bytes:
     Returns:
         bytes: The hashed password.
     """
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(BCRYPT_ROUNDS))
+
+
+def _needs_rehash(hashed_password: bytes) -> bool:
+    """
+    Checks whether a hash was made with a lower cost than BCRYPT_ROUNDS.
+
+    Args:
+        hashed_password (bytes): The stored hash, "$2b$<rounds>$...".
+
+    Returns:
+        bool: True if the password should be hashed again.
+    """
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode('utf-8')
+    return int(hashed_password.split(b'$')[2]) < BCRYPT_ROUNDS
 
 
 def _generate_uuid() -> str:
@@ -72,6 +128,8 @@ class Auth:
     def valid_login(self, email: str, password: str) -> bool:
         """
         Validates the login credentials for the user.
+        A valid password whose hash uses an outdated cost is rehashed
+        with the current one.
 
         Args:
             email (str): The email of the user.
@@ -86,7 +144,12 @@ class Auth:
         except NoResultFound:
             return False
         # Check if the provided password matches the stored hashed password
-        return bcrypt.checkpw(password.encode('utf-8'), user.hashed_password)
+        if not bcrypt.checkpw(password.encode('utf-8'), user.hashed_password):
+            return False
+        if _needs_rehash(user.hashed_password):
+            self._db.update_user(user.id,
+                                 hashed_password=_hash_password(password))
+        return True
 
     def create_session(self, email: str) -> Union[str, None]:
         """